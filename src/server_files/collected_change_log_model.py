@@ -0,0 +1,167 @@
+# collected_change_log_model.py
+
+from datetime import datetime
+
+import pytz
+from sqlalchemy import event, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from website import db
+from website.models.collected.collected_features_model import CollectedFeatures
+from website.models.collected.collected_points_model import CollectedPoints
+from website.models.model_helpers import UTCDateTime
+
+# Maximum number of change log rows inserted in a single statement
+CHANGE_LOG_BATCH_SIZE = 1000
+
+
+class ProjectRevision(db.Model):
+    """Per-project revision counter, incremented by every write to collected data"""
+    project_id = db.Column(db.Integer, db.ForeignKey('project.id'), primary_key=True)
+    revision = db.Column(db.BigInteger, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<ProjectRevision {self.project_id}@{self.revision}>'
+
+
+class CollectedChangeLog(db.Model):
+    """Append-only log of writes to CollectedFeatures and CollectedPoints"""
+    __table_args__ = (
+        # Each revision is allocated once per project; also serves the "after revision R" range scan
+        db.UniqueConstraint('project_id', 'revision', name='uq_collected_change_log_project_revision'),
+    )
+
+    id = db.Column(db.BigInteger, primary_key=True)
+    project_id = db.Column(db.Integer, db.ForeignKey('project.id'), nullable=False)
+    revision = db.Column(db.BigInteger, nullable=False)
+    entity_type = db.Column(db.Enum('feature', 'point', name='change_log_entity_types'), nullable=False)
+    entity_id = db.Column(db.Integer, nullable=False)  # id of the feature or point that was written
+    feature_id = db.Column(db.Integer, nullable=False)  # owning feature, equal to entity_id for features
+    changed_keys = db.Column(db.JSON)  # attribute keys changed by a merge-patch write, NULL for full writes
+    changed_at = db.Column(UTCDateTime, default=lambda: datetime.now(pytz.UTC), nullable=False)
+
+    def __repr__(self):
+        return f'<CollectedChangeLog {self.entity_type} {self.entity_id} @ {self.revision}>'
+
+
+def current_revision(project_id):
+    """Return the latest revision allocated for a project, 0 if nothing was written yet"""
+    revision = db.session.query(ProjectRevision.revision).filter_by(project_id=project_id).scalar()
+    return revision or 0
+
+
+def changed_feature_ids(project_id, after_revision, up_to_revision):
+    """Select the IDs of features written in the revision range (after_revision, up_to_revision]"""
+    return select(CollectedChangeLog.feature_id).where(
+        CollectedChangeLog.project_id == project_id,
+        CollectedChangeLog.revision > after_revision,
+        CollectedChangeLog.revision <= up_to_revision
+    )
+
+
+def changed_attribute_keys(project_id, after_revision, up_to_revision):
+    """
+    Collect which attribute keys changed per entity in a revision range.
+
+    Returns:
+        Dict mapping (entity_type, entity_id) to a set of keys, or to None when any
+        write in the range replaced the attributes whole. Entities not written in the
+        range are absent.
+    """
+    rows = db.session.query(
+        CollectedChangeLog.entity_type,
+        CollectedChangeLog.entity_id,
+        CollectedChangeLog.changed_keys
+    ).filter(
+        CollectedChangeLog.project_id == project_id,
+        CollectedChangeLog.revision > after_revision,
+        CollectedChangeLog.revision <= up_to_revision
+    ).yield_per(CHANGE_LOG_BATCH_SIZE)
+
+    keys = {}
+    for entity_type, entity_id, changed_keys in rows:
+        entity = (entity_type, entity_id)
+        if changed_keys is None:
+            keys[entity] = None
+        elif entity not in keys:
+            keys[entity] = set(changed_keys)
+        elif keys[entity] is not None:
+            keys[entity].update(changed_keys)
+    return keys
+
+
+def allocate_revisions(connection, project_id, count):
+    """
+    Reserve a contiguous block of revisions for a project.
+
+    The counter row is upserted and incremented in a single statement, which also
+    locks it until the transaction ends, so revisions are committed in order.
+
+    Returns:
+        The last revision of the block; the block is (last - count, last]
+    """
+    stmt = insert(ProjectRevision).values(project_id=project_id, revision=count)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[ProjectRevision.project_id],
+        set_={'revision': ProjectRevision.revision + stmt.excluded.revision}
+    ).returning(ProjectRevision.revision)
+    return connection.execute(stmt).scalar_one()
+
+
+def record_changes(project_id, entries, connection=None):
+    """
+    Append change log rows for a set of writes in one project.
+
+    Args:
+        project_id: The project ID
+        entries: List of (entity_type, entity_id, feature_id) tuples, optionally followed
+            by the list of attribute keys the write changed
+        connection: Connection to write with, defaults to the current session's
+
+    Returns:
+        The last revision allocated, or None if there was nothing to record
+    """
+    if not entries:
+        return None
+    if connection is None:
+        connection = db.session.connection()
+
+    last_revision = allocate_revisions(connection, project_id, len(entries))
+    first_revision = last_revision - len(entries) + 1
+    changed_at = datetime.now(pytz.UTC)
+
+    rows = [{
+        'project_id': project_id,
+        'revision': first_revision + offset,
+        'entity_type': entry[0],
+        'entity_id': entry[1],
+        'feature_id': entry[2],
+        'changed_keys': entry[3] if len(entry) > 3 else None,
+        'changed_at': changed_at
+    } for offset, entry in enumerate(entries)]
+
+    for start in range(0, len(rows), CHANGE_LOG_BATCH_SIZE):
+        connection.execute(insert(CollectedChangeLog).values(rows[start:start + CHANGE_LOG_BATCH_SIZE]))
+
+    return last_revision
+
+
+@event.listens_for(Session, 'after_flush')
+def record_orm_changes(session, flush_context):
+    """Log inserts and updates made through the ORM (bulk sync statements log themselves)"""
+    entries = {}
+    for obj in list(session.new) + list(session.dirty):
+        if not isinstance(obj, (CollectedFeatures, CollectedPoints)):
+            continue
+        if obj in session.dirty and not session.is_modified(obj, include_collections=False):
+            continue
+
+        if isinstance(obj, CollectedFeatures):
+            entry = ('feature', obj.id, obj.id)
+        else:
+            entry = ('point', obj.id, obj.feature_id)
+        entries.setdefault(obj.project_id, []).append(entry)
+
+    for project_id, project_entries in entries.items():
+        record_changes(project_id, project_entries, connection=session.connection())
@@ -1,28 +1,52 @@
 # collected_feature_model.py
 import json
 
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
 from website import db
 from datetime import datetime
 import pytz
 
 from website.models.collected.collected_feature_history_model import CollectedFeatureHistory
+from website.models.collected.content_hash import feature_content_hash
 from website.models.model_helpers import UTCDateTime
 
 
 class CollectedFeatures(db.Model):
+    __table_args__ = (
+        # Natural key used by the mobile sync upsert (INSERT ... ON CONFLICT)
+        db.UniqueConstraint('project_id', 'client_id', name='uq_collected_features_project_client'),
+        # Keyset pagination of the change feed
+        db.Index('ix_collected_features_project_updated_id', 'project_id', 'updated_at', 'id'),
+        # Active feature listings of a project (the common is_active filter)
+        db.Index('ix_collected_features_project_active', 'project_id', 'id',
+                 postgresql_where=db.text('is_active')),
+    )
+
     id = db.Column(db.Integer, primary_key=True) # unique DB id
     draw_layer = db.Column(db.String(50), nullable=False)  # Feature category (Water, Electric, Com, etc)
     client_id = db.Column(db.String(20), nullable=False)  # id for Maplibre = db.Column(db.String(50), nullable=False)
     type = db.Column(db.Enum('Point', 'Line', 'Polygon', name='feature_types'), nullable=False)  # feature type ( Point, Line, Polygon )
     name = db.Column(db.String(100))  # name of feature, example ( water valve, water line, com manhole )
     attributes = db.Column(db.JSON)  # any other attributes
+    content_hash = db.Column(db.String(64))  # hash of name, draw_layer, type and attributes, to skip no-op syncs
 
     project_id = db.Column(db.Integer, db.ForeignKey('project.id'), nullable=False, index=True)
 
-    # Relationships
-    project = db.relationship('Project', back_populates='project_features', lazy='joined')
+    # Relationships (lazy by default; endpoints choose their eager loading with query options)
+    project = db.relationship('Project', back_populates='project_features', lazy='select')
     points = db.relationship('CollectedPoints', back_populates='collected_feature',
-                             cascade='all, delete-orphan', lazy='selectin')
+                             cascade='all, delete-orphan', lazy='select')
+    # Read-only view of the points that are still active, in creation order
+    active_points = db.relationship(
+        'CollectedPoints',
+        primaryjoin='and_(CollectedFeatures.id == foreign(CollectedPoints.feature_id), '
+                    'CollectedPoints.is_active == True)',
+        order_by='CollectedPoints.id',
+        viewonly=True,
+        lazy='select'
+    )
 
     is_active = db.Column(db.Boolean, default=True)
 
@@ -68,3 +92,15 @@ class CollectedFeatures(db.Model):
                 setattr(self, key, value)
 
         return self
+
+
+@event.listens_for(Session, 'before_flush')
+def stamp_feature_content_hash(session, flush_context, instances):
+    """Keep content_hash current for features written through the ORM"""
+    for obj in list(session.new) + list(session.dirty):
+        if not isinstance(obj, CollectedFeatures):
+            continue
+        if obj in session.dirty and not any(
+                inspect(obj).attrs[key].history.has_changes() for key in ('name', 'draw_layer', 'type', 'attributes')):
+            continue
+        obj.content_hash = feature_content_hash(obj.name, obj.draw_layer, obj.type, obj.attributes)
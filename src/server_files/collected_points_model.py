@@ -1,28 +1,47 @@
 # collectedPointsModal.py
 
 from website.models.collected.collected_point_history_model import CollectedPointHistory
+from website.models.collected.content_hash import point_geometry_hash
 from website.models.model_helpers import UTCDateTime
 from website import db
 from geoalchemy2 import Geometry
-from sqlalchemy.orm import validates
+from sqlalchemy import event, func, inspect
+from sqlalchemy.orm import Session, column_property, validates
 from datetime import datetime
 import pytz
 import json
 
 
 class CollectedPoints(db.Model):
+    __table_args__ = (
+        # Natural key used by the mobile sync upsert (INSERT ... ON CONFLICT)
+        db.UniqueConstraint('feature_id', 'client_id', name='uq_collected_points_feature_client'),
+        # Active points of a feature, in creation order (CollectedFeatures.active_points)
+        db.Index('ix_collected_points_feature_active', 'feature_id', 'id',
+                 postgresql_where=db.text('is_active')),
+        # Spatial lookups; same name GeoAlchemy2 gave the implicit index, so existing databases match
+        db.Index('idx_collected_points_coords', 'coords', postgresql_using='gist'),
+        # Spatial filters over active points only
+        db.Index('ix_collected_points_coords_active', 'coords', postgresql_using='gist',
+                 postgresql_where=db.text('is_active')),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     client_id = db.Column(db.String(20), nullable=False)
     fcode = db.Column(db.String(5), nullable=False)
-    coords = db.Column(Geometry('Point', srid=4326), nullable=False)
+    coords = db.Column(Geometry('Point', srid=4326, spatial_index=False), nullable=False)
+    # Coordinates read by PostGIS, so serializers need not decode the WKB per point
+    longitude = column_property(func.ST_X(coords))
+    latitude = column_property(func.ST_Y(coords))
     attributes = db.Column(db.JSON)
+    content_hash = db.Column(db.String(64))  # hash of fcode, coordinates and attributes, to skip no-op syncs
 
     project_id = db.Column(db.Integer, db.ForeignKey('project.id'), nullable=False, index=True)
     feature_id = db.Column(db.Integer, db.ForeignKey('collected_features.id'), nullable=False, index=True)
 
-    # Relationships
-    project = db.relationship('Project', back_populates='project_points', lazy='joined')
-    collected_feature = db.relationship('CollectedFeatures', back_populates='points', lazy='joined')
+    # Relationships (lazy by default; endpoints choose their eager loading with query options)
+    project = db.relationship('Project', back_populates='project_points', lazy='select')
+    collected_feature = db.relationship('CollectedFeatures', back_populates='points', lazy='select')
 
     is_active = db.Column(db.Boolean, default=True)
 
@@ -80,3 +99,14 @@ class CollectedPoints(db.Model):
 
         return self
 
+
+@event.listens_for(Session, 'before_flush')
+def stamp_point_content_hash(session, flush_context, instances):
+    """Keep content_hash current for points written through the ORM"""
+    for obj in list(session.new) + list(session.dirty):
+        if not isinstance(obj, CollectedPoints):
+            continue
+        if obj in session.dirty and not any(
+                inspect(obj).attrs[key].history.has_changes() for key in ('fcode', 'coords', 'attributes')):
+            continue
+        obj.content_hash = point_geometry_hash(obj.fcode, obj.coords, obj.attributes)
@@ -0,0 +1,131 @@
+# compression.py
+import gzip
+import io
+import zlib
+
+from flask import request, abort
+from werkzeug.exceptions import BadRequest, RequestEntityTooLarge
+from werkzeug.wsgi import LimitedStream
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is always available
+    brotli = None
+
+# Responses smaller than this are sent uncompressed
+COMPRESSION_MIN_SIZE = 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+# Upper bound on a decompressed request body, to guard against compression bombs
+MAX_DECOMPRESSED_REQUEST_SIZE = 256 * 1024 * 1024
+
+
+class DecompressedBodyTooLarge(RequestEntityTooLarge):
+    """Raised while reading a compressed request body that expands past the size limit"""
+    description = f"Decompressed request body exceeds {MAX_DECOMPRESSED_REQUEST_SIZE} bytes"
+
+
+class CorruptCompressedBody(BadRequest):
+    """Raised while reading a request body that is not valid for its Content-Encoding"""
+    description = "Request body could not be decompressed"
+
+
+def register_compression(blueprint, min_size=COMPRESSION_MIN_SIZE, gzip_level=GZIP_LEVEL,
+                         brotli_quality=BROTLI_QUALITY, decompress_requests=False):
+    """
+    Enable negotiated response compression (brotli or gzip) for a blueprint's routes.
+
+    Args:
+        blueprint: Blueprint to register the hooks on
+        min_size: Smallest response body, in bytes, that gets compressed
+        gzip_level: gzip compression level
+        brotli_quality: brotli quality, used when the brotli package is installed
+        decompress_requests: Also accept request bodies sent with Content-Encoding gzip or br
+    """
+    offered = ['br', 'gzip'] if brotli is not None else ['gzip']
+
+    if decompress_requests:
+        @blueprint.before_request
+        def decompress_request_body():
+            encoding = request.headers.get('Content-Encoding', '').strip().lower()
+            if not encoding or encoding == 'identity':
+                return None
+            if encoding not in offered:
+                abort(415, description=f"Unsupported Content-Encoding: {encoding}")
+
+            # Swap the input for a decompressing stream, so streaming readers still work
+            environ = request.environ
+            raw = environ['wsgi.input']
+            if request.content_length is not None:
+                raw = LimitedStream(raw, request.content_length)
+            environ['wsgi.input'] = io.BufferedReader(_DecompressingReader(raw, encoding))
+            environ['wsgi.input_terminated'] = True
+            environ.pop('CONTENT_LENGTH', None)
+            environ.pop('HTTP_CONTENT_ENCODING', None)
+            request.__dict__.pop('stream', None)
+            return None
+
+    @blueprint.after_request
+    def compress_response(response):
+        if (response.status_code < 200 or response.status_code in (204, 304)
+                or response.direct_passthrough or response.is_streamed
+                or 'Content-Encoding' in response.headers):
+            return response
+
+        encoding = request.accept_encodings.best_match(offered)
+        if encoding is None:
+            return response
+
+        data = response.get_data()
+        if len(data) < min_size:
+            return response
+
+        if encoding == 'br':
+            compressed = brotli.compress(data, quality=brotli_quality)
+        else:
+            compressed = gzip.compress(data, compresslevel=gzip_level)
+
+        response.set_data(compressed)
+        response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+        return response
+
+
+# Errors raised by gzip or brotli on a truncated or corrupt body
+_DECOMPRESSION_ERRORS = (OSError, EOFError, zlib.error) + ((brotli.error,) if brotli is not None else ())
+
+
+class _DecompressingReader(io.RawIOBase):
+    """Readable stream that decompresses a gzip or brotli request body as it is read"""
+
+    def __init__(self, raw, encoding):
+        self._raw = raw
+        self._decompressor = brotli.Decompressor() if encoding == 'br' else None
+        self._gzip = gzip.GzipFile(fileobj=raw, mode='rb') if encoding == 'gzip' else None
+        self._buffer = b''
+        self._total = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        size = len(buffer)
+        try:
+            if self._gzip is not None:
+                chunk = self._gzip.read(size)
+            else:
+                while not self._buffer:
+                    compressed = self._raw.read(64 * 1024)
+                    if not compressed:
+                        break
+                    self._buffer = self._decompressor.process(compressed)
+                chunk, self._buffer = self._buffer[:size], self._buffer[size:]
+        except _DECOMPRESSION_ERRORS as e:
+            raise CorruptCompressedBody() from e
+
+        self._total += len(chunk)
+        if self._total > MAX_DECOMPRESSED_REQUEST_SIZE:
+            raise DecompressedBodyTooLarge()
+
+        buffer[:len(chunk)] = chunk
+        return len(chunk)
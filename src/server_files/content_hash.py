@@ -0,0 +1,33 @@
+# content_hash.py
+import hashlib
+import json
+import struct
+
+from geoalchemy2.shape import to_shape
+
+_COORDINATE_PAIR = struct.Struct('<2d')
+
+
+def _digest(geometry_bytes, *fields):
+    """SHA-256 over canonical JSON of the fields, followed by the geometry bytes"""
+    digest = hashlib.sha256(json.dumps(fields, sort_keys=True, separators=(',', ':'), default=str).encode('utf-8'))
+    digest.update(geometry_bytes)
+    return digest.hexdigest()
+
+
+def feature_content_hash(name, draw_layer, feature_type, attributes):
+    """Hash of the synced content of a feature: name, layer, type and attributes"""
+    return _digest(b'', name, draw_layer, feature_type, attributes or {})
+
+
+def point_content_hash(fcode, longitude, latitude, attributes):
+    """Hash of the synced content of a point: feature code, coordinates and attributes"""
+    return _digest(_COORDINATE_PAIR.pack(float(longitude), float(latitude)), fcode, attributes or {})
+
+
+def point_geometry_hash(fcode, coords, attributes):
+    """point_content_hash() for a point whose coords are a geometry element, None if it has none"""
+    if coords is None:
+        return None
+    point = to_shape(coords)
+    return point_content_hash(fcode, point.x, point.y, attributes)
@@ -0,0 +1,163 @@
+# feature_catalog.py
+import gzip
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+from flask import current_app, request, make_response
+from website import db
+from website.models.feature.feature_model import Feature
+from website.models.worktype_model import worktype_features
+
+try:
+    import redis
+except ImportError:  # the shared cache is optional
+    redis = None
+
+# Catalog versions rotate this often so that snapshots never hold image URLs close to expiry
+CATALOG_VERSION_PERIOD = 6 * 60 * 60
+# Number of work type snapshots kept in each worker
+CATALOG_CACHE_SIZE = 64
+SHARED_CACHE_PREFIX = 'feature_catalog'
+
+
+def feature_catalog_version(work_type_id):
+    """
+    Compute a version for a work type's feature catalog without loading the catalog.
+
+    The version covers which features belong to the work type and when each was last
+    updated, so it changes whenever a Feature or worktype_features row changes. It also
+    rotates every CATALOG_VERSION_PERIOD so that clients never keep image URLs past
+    their expiry.
+
+    Returns:
+        Tuple of (ETag value, Last-Modified datetime)
+    """
+    rows = db.session.query(Feature.id, Feature.updated_at).join(worktype_features).filter(
+        worktype_features.c.worktype_id == work_type_id
+    ).order_by(Feature.id).all()
+
+    url_generation = int(time.time() // CATALOG_VERSION_PERIOD)
+    digest = hashlib.sha1(f"{work_type_id}:{url_generation}".encode('utf-8'))
+    last_modified = datetime.fromtimestamp(url_generation * CATALOG_VERSION_PERIOD, tz=timezone.utc)
+
+    for feature_id, updated_at in rows:
+        digest.update(f"|{feature_id}:{updated_at.isoformat() if updated_at else ''}".encode('utf-8'))
+        if updated_at:
+            if updated_at.tzinfo is None:
+                updated_at = updated_at.replace(tzinfo=timezone.utc)
+            last_modified = max(last_modified, updated_at)
+
+    return digest.hexdigest(), last_modified
+
+
+class CatalogSnapshot:
+    """Serialized, gzip-compressed catalog response for one version of a work type"""
+
+    def __init__(self, work_type_id, etag, last_modified, body):
+        self.work_type_id = work_type_id
+        self.etag = etag
+        self.last_modified = last_modified
+        self.body = body
+
+    def to_response(self):
+        """Build the HTTP response, sending the compressed bytes as-is when the client accepts gzip"""
+        if 'gzip' in request.accept_encodings:
+            response = make_response(self.body)
+            response.headers['Content-Encoding'] = 'gzip'
+        else:
+            response = make_response(gzip.decompress(self.body))
+        response.mimetype = 'application/json'
+        response.vary.add('Accept-Encoding')
+        response.set_etag(self.etag)
+        response.last_modified = self.last_modified
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+
+
+class CatalogSnapshotCache:
+    """
+    Per-worker LRU of catalog snapshots, backed by a shared cache when one is configured.
+
+    Snapshots are keyed by work type and catalog version, so a stale snapshot is never
+    served: a version change simply misses and rebuilds. invalidate_feature() evicts
+    the snapshots of the work types a feature belongs to as soon as it changes.
+    """
+
+    def __init__(self, maxsize=CATALOG_CACHE_SIZE, shared_url=None):
+        self.maxsize = maxsize
+        self._snapshots = OrderedDict()
+        self._lock = threading.Lock()
+        self._shared = redis.Redis.from_url(shared_url) if redis and shared_url else None
+
+    def get(self, work_type_id, etag, last_modified, build):
+        """
+        Return the snapshot for a work type version, building it with build() if needed.
+
+        Args:
+            work_type_id: The work type ID
+            etag: Catalog version from feature_catalog_version()
+            last_modified: Last-Modified datetime from feature_catalog_version()
+            build: Callable returning the list of feature dicts for the work type
+        """
+        with self._lock:
+            snapshot = self._snapshots.get(work_type_id)
+            if snapshot and snapshot.etag == etag:
+                self._snapshots.move_to_end(work_type_id)
+                return snapshot
+
+        body = self._shared_get(work_type_id, etag)
+        if body is None:
+            payload = current_app.json.dumps({
+                'success': True,
+                'features': build()
+            })
+            body = gzip.compress(payload.encode('utf-8'))
+            self._shared_set(work_type_id, etag, body)
+
+        snapshot = CatalogSnapshot(work_type_id, etag, last_modified, body)
+        with self._lock:
+            self._snapshots[work_type_id] = snapshot
+            self._snapshots.move_to_end(work_type_id)
+            while len(self._snapshots) > self.maxsize:
+                self._snapshots.popitem(last=False)
+        return snapshot
+
+    def invalidate_work_types(self, work_type_ids):
+        with self._lock:
+            for work_type_id in work_type_ids:
+                self._snapshots.pop(work_type_id, None)
+
+    def invalidate_feature(self, feature_id):
+        """Evict the snapshots of every work type that contains the feature"""
+        work_type_ids = [row.worktype_id for row in db.session.query(worktype_features.c.worktype_id).filter(
+            worktype_features.c.feature_id == feature_id
+        )]
+        self.invalidate_work_types(work_type_ids)
+
+    def _shared_key(self, work_type_id, etag):
+        return f"{SHARED_CACHE_PREFIX}:{work_type_id}:{etag}"
+
+    def _shared_get(self, work_type_id, etag):
+        if self._shared is None:
+            return None
+        try:
+            return self._shared.get(self._shared_key(work_type_id, etag))
+        except Exception as e:
+            print(f"Warning: Could not read catalog snapshot from shared cache: {str(e)}")
+            return None
+
+    def _shared_set(self, work_type_id, etag, body):
+        if self._shared is None:
+            return
+        try:
+            # Versions rotate every CATALOG_VERSION_PERIOD, so older keys are never read again
+            self._shared.set(self._shared_key(work_type_id, etag), body, ex=CATALOG_VERSION_PERIOD)
+        except Exception as e:
+            print(f"Warning: Could not write catalog snapshot to shared cache: {str(e)}")
+
+
+catalog_snapshots = CatalogSnapshotCache(shared_url=os.environ.get('REDIS_URL'))
@@ -0,0 +1,70 @@
+# feature_images.py
+import datetime
+import threading
+import time
+
+# Signed URLs handed to clients are valid for 24 hours
+SIGNED_URL_EXPIRATION = datetime.timedelta(hours=24)
+# Cached URLs are replaced after 12 hours, so a cached URL always has 12+ hours left
+SIGNED_URL_CACHE_TTL = 12 * 60 * 60
+# Missing images are re-checked sooner, since another worker may have uploaded them
+MISSING_IMAGE_CACHE_TTL = 5 * 60
+
+
+def feature_image_path(draw_layer, image_file_name):
+    """Object path of a feature type's PNG in the bucket"""
+    return f"Feature_PNG/{draw_layer}/{image_file_name}"
+
+
+class SignedUrlCache:
+    """
+    Process-local cache of signed GET URLs keyed by object path.
+
+    Also remembers which objects do not exist, so repeated lookups make no storage
+    calls at all. The upload and delete paths invalidate the entries they touch.
+    """
+
+    def __init__(self, ttl=SIGNED_URL_CACHE_TTL, missing_ttl=MISSING_IMAGE_CACHE_TTL):
+        self.ttl = ttl
+        self.missing_ttl = missing_ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, bucket, object_path, credentials):
+        """Return a signed URL for the object, or None if it does not exist in the bucket"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(object_path)
+        if entry and entry[1] > now:
+            return entry[0]
+
+        blob = bucket.blob(object_path)
+        if blob.exists():
+            signed_url = blob.generate_signed_url(
+                version="v4",
+                expiration=SIGNED_URL_EXPIRATION,
+                method="GET",
+                credentials=credentials
+            )
+            expires_at = now + self.ttl
+        else:
+            print(f"Warning: Image does not exist in bucket: {object_path}")
+            signed_url = None
+            expires_at = now + self.missing_ttl
+
+        with self._lock:
+            self._entries[object_path] = (signed_url, expires_at)
+        return signed_url
+
+    def invalidate(self, *object_paths):
+        """Drop cached entries after the objects were uploaded, replaced or deleted"""
+        with self._lock:
+            for object_path in object_paths:
+                self._entries.pop(object_path, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+signed_url_cache = SignedUrlCache()
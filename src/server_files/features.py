@@ -1,11 +1,12 @@
 # features.py
-import json
+import hashlib
+import math
 import os
 import uuid
 from datetime import datetime
 
 import pytz
-from flask import Blueprint, render_template, request, flash, jsonify, redirect, url_for, session
+from flask import Blueprint, current_app, render_template, request, flash, jsonify, redirect, url_for, session, Response
 from flask_login import login_required, current_user
 from geoalchemy2.shape import from_shape
 from google.cloud import storage
@@ -13,10 +14,21 @@ from google.oauth2 import service_account
 from shapely import Point, LineString, Polygon
 from sqlalchemy.exc import SQLAlchemyError
 from website import db
-from sqlalchemy import or_, func
+from website.blueprints.auth_decorators import flexible_login_required
+from website.blueprints.compression import register_compression
+from website.blueprints.feature_catalog import catalog_snapshots
+from website.blueprints.feature_images import feature_image_path
+from website.blueprints.image_uploads import ImageUploadPipeline, create_image_storage
+from website.blueprints.json_provider import register_json_provider
+from website.blueprints.project_access import project_access_required
+from website.blueprints.spatial_filters import SpatialFilter
+from sqlalchemy import JSON, Text, and_, case, cast, literal_column, or_, func, select
+from sqlalchemy.dialects.postgresql import aggregate_order_by
+from sqlalchemy.orm import aliased
 from website.forms import FeatureForm, FeatureFormEdit
 from werkzeug.utils import secure_filename
 
+from website.models.collected.collected_change_log_model import current_revision
 from website.models.collected.collected_features_model import CollectedFeatures
 from website.models.collected.collected_points_model import CollectedPoints
 from website.models.feature.feature_model import Feature
@@ -30,13 +42,24 @@ credentials = service_account.Credentials.from_service_account_file(
 
 
 features_bp = Blueprint('features', __name__)
+# Compress the GeoJSON responses; vector tiles are already compact
+register_compression(features_bp)
+register_json_provider(features_bp)
 
 # global settings variables
 delete_toggle = False
+# Vector tile settings for collected features
+TILE_LAYER_NAME = 'collected_features'
+MAX_TILE_ZOOM = 24
+# Features are rendered in a tile when one of their vertices lies within this many
+# tile widths of it, which catches lines and polygons crossing the tile
+TILE_CANDIDATE_MARGIN = 1
 storage_client = storage.Client(credentials=credentials)
 # Define the name of the bucket
 bucket_name = os.environ.get("APP_BUCKET_NAME")
 bucket = storage_client.bucket(bucket_name)
+# Feature PNGs are uploaded in the background; IMAGE_STORAGE_DIR switches to local storage
+image_uploads = ImageUploadPipeline(create_image_storage(bucket))
 
 
 @features_bp.route('/create_feature/', methods=['GET', 'POST'])
@@ -64,6 +87,8 @@ def create_feature():
 
             # Process the PNG file if uploaded
             image_filename = ''
+            image_upload = None
+            old_storage_path = None
             if form.png_image.data:
                 try:
                     # Get the PNG file
@@ -75,27 +100,22 @@ def create_feature():
                     filename = f"{safe_name}.png"
                     storage_path = f"Feature_PNG/{feature_type}/{filename}"
 
-                    # If the feature exists and already has an image, delete the old one
+                    # If the feature exists and already has an image, the old one is deleted
+                    # once the new upload succeeds and the feature is committed
                     if existing_feature and existing_feature.image_path:
                         old_storage_path = f"Feature_PNG/{feature_type}/{existing_feature.image_path}"
-                        if old_storage_path != storage_path:
-                            try:
-                                old_blob = bucket.blob(old_storage_path)
-                                old_blob.delete()
-                                print(f"Deleted old image: {old_storage_path}")
-                            except Exception as e:
-                                print(f"Warning: Could not delete old image: {str(e)}")
-
-                    # Upload the new file (this will overwrite existing file with same path)
-                    blob = bucket.blob(storage_path)
-                    blob.upload_from_string(
-                        png_file.read(),
-                        content_type=png_file.content_type
+
+                    # Upload the new file in the background (this will overwrite existing file with same path)
+                    image_upload = image_uploads.upload(
+                        storage_path,
+                        png_file,
+                        png_file.content_type,
+                        cached_paths=[feature_image_path(form.draw_layer.data or '', filename)]
                     )
 
                     # Store only the filename, not the full path
                     image_filename = filename
-                    print(f"PNG uploaded to: {storage_path}")
+                    print(f"PNG upload started to: {storage_path}")
                     print(f"Filename '{filename}' will be saved to database")
 
                 except Exception as e:
@@ -120,8 +140,11 @@ def create_feature():
                     existing_feature.svg = form.svg.data or ''
                     existing_feature.image_file_name = image_filename
                     existing_feature.z_value = z_value
+                    existing_feature.updated_at = datetime.now(pytz.UTC)
 
                     db.session.commit()
+                    catalog_snapshots.invalidate_feature(existing_feature.id)
+                    refresh_catalog_when_uploaded(image_upload, existing_feature.id, replaces=old_storage_path)
                     print(f"Feature updated in database with image_path: {existing_feature.image_path}")
                     flash('Feature updated successfully!', 'success')
                     return redirect(url_for('projects.display_features'))
@@ -141,6 +164,8 @@ def create_feature():
                     )
 
                     if feature:
+                        catalog_snapshots.invalidate_feature(feature.id)
+                        refresh_catalog_when_uploaded(image_upload, feature.id)
                         print(f"New feature created with image_path: {image_filename}")
                         flash('Feature created successfully!', 'success')
                         return redirect(url_for('projects.display_features'))
@@ -193,7 +218,9 @@ def toggle_feature_active():
             return jsonify({'error': 'Feature not found'}), 404
 
         feature.is_active = not feature.is_active  # Toggle the status
+        feature.updated_at = datetime.now(pytz.UTC)
         db.session.commit()
+        catalog_snapshots.invalidate_feature(feature.id)
 
         return jsonify({
             'success': True,
@@ -219,6 +246,8 @@ def edit_feature():
             # Access the file directly from request.files
             uploaded_file = request.files.get('png_image')
             print("uploaded file", uploaded_file)
+            image_upload = None
+            old_storage_path = None
             if uploaded_file and uploaded_file.filename:
                 try:
                     # Create a filename based on the feature name
@@ -229,31 +258,26 @@ def edit_feature():
                     # Define storage path for Google Cloud
                     storage_path = f"Feature_PNG/{feature_type}/{filename}"
 
-                    # Check if feature already has an image and delete old one if needed
+                    # If the feature already has an image, the old one is deleted once the new
+                    # upload succeeds and the feature is committed
                     if hasattr(feature, 'image_path') and feature.image_path:
                         old_feature_type = feature.type
                         old_storage_path = f"Feature_PNG/{old_feature_type}/{feature.image_path}"
 
-                        if old_storage_path != storage_path:
-                            try:
-                                old_blob = bucket.blob(old_storage_path)
-                                old_blob.delete()
-                                print(f"Deleted old image: {old_storage_path}")
-                            except Exception as e:
-                                print(f"Warning: Could not delete old image: {str(e)}")
-
-                    # Upload the new file
-                    blob = bucket.blob(storage_path)
-                    file_content = uploaded_file.read()
-
-                    blob.upload_from_string(
-                        file_content,
-                        content_type=uploaded_file.content_type
+                    # Upload the new file in the background
+                    image_upload = image_uploads.upload(
+                        storage_path,
+                        uploaded_file,
+                        uploaded_file.content_type,
+                        cached_paths=[
+                            feature_image_path(feature.draw_layer, filename),
+                            feature_image_path(form.draw_layer.data, filename)
+                        ]
                     )
 
                     # Store only the filename in the database using the correct field name
                     feature.image_path = filename
-                    print(f"PNG uploaded successfully to: {storage_path}")
+                    print(f"PNG upload started to: {storage_path}")
                     print(f"Filename '{filename}' saved to database as image_path")
 
                 except Exception as e:
@@ -272,9 +296,12 @@ def edit_feature():
             feature.label = form.label.data
             feature.svg = form.svg.data
             feature.z_value = int(form.z_value.data)
+            feature.updated_at = datetime.now(pytz.UTC)
 
             try:
                 db.session.commit()
+                catalog_snapshots.invalidate_feature(feature.id)
+                refresh_catalog_when_uploaded(image_upload, feature.id, replaces=old_storage_path)
                 print(f"Feature updated in database with image_path: {feature.image_path}")
                 flash('Feature updated successfully!', 'success')
                 return redirect(url_for('projects.display_features'))
@@ -526,154 +553,43 @@ def save_feature():
 @features_bp.route('/api/project_features/<int:project_id>', methods=['GET'])
 @login_required
 def get_project_features(project_id):
-    """Get all features for a project in GeoJSON format"""
+    """Get all features for a project in GeoJSON format, optionally limited to a bbox or radius"""
     try:
-        # Query for features related to this project (only active ones)
-        collected_features = CollectedFeatures.query.filter_by(
-            project_id=project_id,
-            is_active=True
-        ).all()
-
-        # Get all available features for reference, indexed by name
-        features_lookup = {feature.name: feature for feature in Feature.query.filter_by(is_active=True).all()}
-
-        # Prepare GeoJSON collection
-        geojson_data = {
-            "type": "FeatureCollection",
-            "features": []
-        }
-
-        # For each collected feature, create a GeoJSON feature
-        for collected_feature in collected_features:
-            # Look up the feature definition by name
-            feature_def = features_lookup.get(collected_feature.name)
-
-            # Handle different feature types
-            if collected_feature.type == 'Point':
-                # For Point features (which have only one point associated)
-                if collected_feature.points and len(collected_feature.points) > 0:
-                    point = collected_feature.points[0]  # Get the first (and should be only) point
-                    if point.is_active and point.coords is not None:
-                        # Get WKB hex and convert to coordinates
-                        point_geom = db.session.scalar(func.ST_AsGeoJSON(point.coords))
-                        point_json = json.loads(point_geom)
-
-                        # Add styling information from the feature definition
-                        style_info = {}
-                        if feature_def:
-                            style_info = {
-                                "color": feature_def.color,
-                                "lineWeight": feature_def.line_weight,
-                                "dashPattern": feature_def.dash_pattern,
-                                "svg": feature_def.svg
-                            }
-
-                        geojson_feature = {
-                            "type": "Feature",
-                            "geometry": {
-                                "type": "Point",
-                                "coordinates": point_json["coordinates"]
-                            },
-                            "properties": {
-                                "id": collected_feature.id,
-                                "name": collected_feature.name,
-                                "category": collected_feature.category,
-                                "type": collected_feature.type,
-                                "color": style_info.get("color"),
-                                "lineWeight": style_info.get("lineWeight"),
-                                "dashPattern": style_info.get("dashPattern"),
-                                "svg": style_info.get("svg")
-                            }
-                        }
-                        geojson_data["features"].append(geojson_feature)
-
-            elif collected_feature.type == 'Line':
-                # For Line features (which have multiple points)
-                active_points = [p for p in collected_feature.points if p.is_active and p.coords is not None]
-                if active_points:
-                    # Extract coordinates from points
-                    coordinates = []
-                    for point in active_points:
-                        point_geom = db.session.scalar(func.ST_AsGeoJSON(point.coords))
-                        point_json = json.loads(point_geom)
-                        coordinates.append(point_json["coordinates"])
-
-                    # Add styling information from the feature definition
-                    style_info = {}
-                    if feature_def:
-                        style_info = {
-                            "color": feature_def.color,
-                            "lineWeight": feature_def.line_weight,
-                            "dashPattern": feature_def.dash_pattern,
-                            "svg": feature_def.svg
-                        }
-
-                    # Create a LineString feature
-                    geojson_feature = {
-                        "type": "Feature",
-                        "geometry": {
-                            "type": "LineString",
-                            "coordinates": coordinates
-                        },
-                        "properties": {
-                            "id": collected_feature.id,
-                            "name": collected_feature.name,
-                            "category": collected_feature.category,
-                            "type": collected_feature.type,
-                            "color": style_info.get("color"),
-                            "lineWeight": style_info.get("lineWeight"),
-                            "dashPattern": style_info.get("dashPattern"),
-                            "svg": style_info.get("svg")
-                        }
-                    }
-                    geojson_data["features"].append(geojson_feature)
-
-            elif collected_feature.type == 'Polygon':
-                # For Polygon features (multiple points forming a closed ring)
-                active_points = [p for p in collected_feature.points if p.is_active and p.coords is not None]
-                if active_points:
-                    # Extract coordinates from points
-                    coordinates = []
-                    for point in active_points:
-                        point_geom = db.session.scalar(func.ST_AsGeoJSON(point.coords))
-                        point_json = json.loads(point_geom)
-                        coordinates.append(point_json["coordinates"])
-
-                    # Make sure polygon is closed (first point = last point)
-                    if coordinates and coordinates[0] != coordinates[-1]:
-                        coordinates.append(coordinates[0])
-
-                    # Add styling information from the feature definition
-                    style_info = {}
-                    if feature_def:
-                        style_info = {
-                            "color": feature_def.color,
-                            "lineWeight": feature_def.line_weight,
-                            "dashPattern": feature_def.dash_pattern,
-                            "svg": feature_def.svg
-                        }
-
-                    # Create a Polygon feature (GeoJSON requires an array of linear rings)
-                    geojson_feature = {
-                        "type": "Feature",
-                        "geometry": {
-                            "type": "Polygon",
-                            "coordinates": [coordinates]  # Note the extra array level
-                        },
-                        "properties": {
-                            "id": collected_feature.id,
-                            "name": collected_feature.name,
-                            "category": collected_feature.category,
-                            "type": collected_feature.type,
-                            "color": style_info.get("color"),
-                            "lineWeight": style_info.get("lineWeight"),
-                            "dashPattern": style_info.get("dashPattern"),
-                            "svg": style_info.get("svg")
-                        }
-                    }
-                    geojson_data["features"].append(geojson_feature)
-
-        return jsonify({"success": True, "features": geojson_data["features"]})
+        try:
+            spatial_filter = SpatialFilter.from_args(request.args)
+        except ValueError as e:
+            return jsonify({"success": False, "error": str(e)}), 400
+
+        geometries = project_geometries(project_id)
+        styles = feature_styles()
+
+        geojson_feature = func.json_build_object(
+            'type', 'Feature',
+            'geometry', cast(func.ST_AsGeoJSON(geometries.c.geometry), JSON),
+            'properties', func.json_build_object(
+                'id', geometries.c.id,
+                'name', geometries.c.name,
+                'category', geometries.c.draw_layer,
+                'type', geometries.c.type,
+                'color', styles.c.color,
+                'lineWeight', styles.c.line_weight,
+                'dashPattern', styles.c.dash_pattern,
+                'svg', styles.c.svg
+            )
+        )
+
+        # The whole feature list is assembled by PostGIS and passed through as text
+        stmt = select(
+            func.coalesce(cast(func.json_agg(aggregate_order_by(geojson_feature, geometries.c.id)), Text), '[]')
+        ).select_from(
+            geometries.outerjoin(styles, styles.c.name == geometries.c.name)
+        )
+        if spatial_filter:
+            # Test the assembled geometry, so lines and polygons crossing the area are kept
+            stmt = stmt.where(spatial_filter.condition(geometries.c.geometry))
+        features_json = db.session.execute(stmt).scalar_one()
+
+        return Response(f'{{"success": true, "features": {features_json}}}', mimetype='application/json')
 
     except Exception as e:
         db.session.rollback()
@@ -683,6 +599,195 @@ def get_project_features(project_id):
         return jsonify({"success": False, "error": str(e)}), 500
 
 
+@features_bp.route('/<int:project_id>/tiles/<int:z>/<int:x>/<int:y>.mvt', methods=['GET'])
+@flexible_login_required
+@project_access_required
+def get_feature_tile(project_id, z, x, y):
+    """Get the collected features of a project that fall in one map tile, as a Mapbox Vector Tile"""
+    if not 0 <= z <= MAX_TILE_ZOOM or not 0 <= x < 2 ** z or not 0 <= y < 2 ** z:
+        return jsonify({"success": False, "error": "Invalid tile coordinates"}), 400
+
+    try:
+        # The tile only changes with the project's data or the catalog styling
+        etag = feature_tile_etag(project_id, z, x, y)
+        if request.if_none_match.contains_weak(etag):
+            not_modified = Response(status=304)
+            not_modified.set_etag(etag)
+            not_modified.headers['Cache-Control'] = 'private, no-cache'
+            return not_modified
+
+        # Only features with a vertex near the tile are assembled, found through the
+        # GiST index on point coordinates
+        geometries = project_geometries(project_id, tile_candidate_area(z, x, y))
+        styles = feature_styles()
+        envelope = func.ST_TileEnvelope(z, x, y)
+
+        tile = select(
+            func.ST_AsMVTGeom(func.ST_Transform(geometries.c.geometry, 3857), envelope).label('geom'),
+            geometries.c.id,
+            geometries.c.name,
+            geometries.c.draw_layer,
+            geometries.c.type,
+            styles.c.color,
+            styles.c.line_weight,
+            styles.c.dash_pattern,
+            styles.c.label,
+            styles.c.z_value
+        ).select_from(
+            geometries.outerjoin(styles, styles.c.name == geometries.c.name)
+        ).where(
+            func.ST_Intersects(geometries.c.geometry, func.ST_Transform(envelope, 4326))
+        ).subquery('tile')
+
+        stmt = select(
+            func.ST_AsMVT(literal_column('tile'), TILE_LAYER_NAME, 4096, 'geom')
+        ).select_from(tile).where(tile.c.geom.isnot(None))
+        tile_data = db.session.execute(stmt).scalar()
+
+        response = Response(bytes(tile_data or b''), mimetype='application/vnd.mapbox-vector-tile')
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+
+    except Exception as e:
+        db.session.rollback()
+        print(f"Error building feature tile {z}/{x}/{y}: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
+def feature_tile_etag(project_id, z, x, y):
+    """ETag of a feature tile, from the project revision, the catalog styling and the tile address"""
+    styles_updated_at, styles_count = db.session.query(func.max(Feature.updated_at), func.count(Feature.id)).one()
+    digest = hashlib.sha1(
+        f"{project_id}:{current_revision(project_id)}:{styles_updated_at}:{styles_count}:{z}/{x}/{y}".encode('utf-8')
+    )
+    return digest.hexdigest()
+
+
+def tile_candidate_area(z, x, y, margin=TILE_CANDIDATE_MARGIN):
+    """WGS84 envelope of an XYZ tile grown by `margin` tile widths on every side, clamped to the world"""
+    tiles = 2 ** z
+    min_x, max_x = max(x - margin, 0), min(x + 1 + margin, tiles)
+    min_y, max_y = max(y - margin, 0), min(y + 1 + margin, tiles)
+
+    def longitude(tile_x):
+        return tile_x / tiles * 360.0 - 180.0
+
+    def latitude(tile_y):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * tile_y / tiles))))
+
+    # Tiles at the top and bottom edge of the grid reach the poles
+    south = -90.0 if max_y == tiles else latitude(max_y)
+    north = 90.0 if min_y == 0 else latitude(min_y)
+    return func.ST_MakeEnvelope(longitude(min_x), south, longitude(max_x), north, 4326)
+
+
+def project_geometries(project_id, candidate_area=None):
+    """
+    Subquery building one geometry per active feature of a project from its active points.
+
+    Vertices are ordered by point ID. Points use the first vertex, Lines need at least
+    two vertices and Polygons are closed and need at least three distinct vertices;
+    features that cannot form a geometry are left out. With candidate_area, only
+    features having an active vertex in that WGS84 geometry are built.
+    """
+    conditions = [
+        CollectedPoints.project_id == project_id,
+        CollectedPoints.is_active == True,
+        CollectedPoints.coords.isnot(None)
+    ]
+    if candidate_area is not None:
+        candidate_points = aliased(CollectedPoints)
+        conditions.append(CollectedPoints.feature_id.in_(
+            select(candidate_points.feature_id).where(
+                candidate_points.project_id == project_id,
+                candidate_points.is_active == True,
+                func.ST_Intersects(candidate_points.coords, candidate_area)
+            )
+        ))
+
+    vertices = select(
+        CollectedPoints.feature_id,
+        func.array_agg(aggregate_order_by(CollectedPoints.coords, CollectedPoints.id)).label('vertices'),
+        func.count(CollectedPoints.id).label('vertex_count')
+    ).where(
+        *conditions
+    ).group_by(CollectedPoints.feature_id).subquery()
+
+    line = func.ST_MakeLine(vertices.c.vertices)
+    ring = case((func.ST_IsClosed(line), line), else_=func.ST_AddPoint(line, func.ST_StartPoint(line)))
+
+    geometry = case(
+        (CollectedFeatures.type == 'Point', vertices.c.vertices[1]),
+        (and_(CollectedFeatures.type == 'Line', vertices.c.vertex_count >= 2), line),
+        (and_(CollectedFeatures.type == 'Polygon', vertices.c.vertex_count >= 3, func.ST_NPoints(ring) >= 4),
+         func.ST_MakePolygon(ring)),
+    )
+
+    features = select(
+        CollectedFeatures.id,
+        CollectedFeatures.name,
+        CollectedFeatures.draw_layer,
+        CollectedFeatures.type,
+        geometry.label('geometry')
+    ).join(
+        vertices, vertices.c.feature_id == CollectedFeatures.id
+    ).where(
+        CollectedFeatures.project_id == project_id,
+        CollectedFeatures.is_active == True
+    ).subquery()
+
+    return select(features).where(features.c.geometry.isnot(None)).subquery()
+
+
+def feature_styles():
+    """Subquery with the styling of each active catalog feature, one row per name"""
+    return select(
+        Feature.name,
+        Feature.color,
+        Feature.line_weight,
+        Feature.dash_pattern,
+        Feature.svg,
+        Feature.label,
+        Feature.z_value
+    ).where(
+        Feature.is_active == True
+    ).distinct(Feature.name).order_by(Feature.name, Feature.id.desc()).subquery()
+
+
+def refresh_catalog_when_uploaded(image_upload, feature_id, replaces=None):
+    """
+    Bump a feature's catalog version once its background image upload succeeds.
+
+    Call only after the feature row is committed. The catalog may have been rebuilt
+    between the commit and the end of the upload, without the new image; touching
+    updated_at changes the catalog ETag everywhere. The image the feature referenced
+    before, `replaces`, is queued for deletion at the same point, so a failed upload
+    or a rolled-back commit never loses the image the row still points at.
+    """
+    if image_upload is None:
+        return
+    app = current_app._get_current_object()
+
+    def refresh(future):
+        if future.exception() is not None:
+            return
+        if replaces and replaces != future.result():
+            image_uploads.delete_later(replaces)
+        with app.app_context():
+            try:
+                Feature.query.filter_by(id=feature_id).update({'updated_at': datetime.now(pytz.UTC)})
+                db.session.commit()
+                catalog_snapshots.invalidate_feature(feature_id)
+            except Exception as e:
+                db.session.rollback()
+                print(f"Warning: Could not refresh catalog after image upload: {str(e)}")
+
+    image_upload.add_done_callback(refresh)
+
+
 @features_bp.route('/api/update_feature', methods=['POST'])
 @login_required
 def update_feature():
@@ -857,6 +962,7 @@ def save_form_definition(feature_id):
         feature.updated_at = datetime.now(pytz.UTC)
 
         db.session.commit()
+        catalog_snapshots.invalidate_feature(feature.id)
         print("Form definition saved successfully!")  # Debug line
 
         return jsonify({'success': True, 'message': 'Form definition saved successfully'})
@@ -891,6 +997,7 @@ def clear_form_definition(feature_id):
         feature.updated_at = datetime.now(pytz.UTC)
 
         db.session.commit()
+        catalog_snapshots.invalidate_feature(feature.id)
 
         return jsonify({'success': True, 'message': 'Form definition cleared'})
 
@@ -0,0 +1,157 @@
+# image_uploads.py
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from website.blueprints.feature_images import signed_url_cache
+
+# Resumable uploads send the file in chunks of this size (a multiple of 256 KiB, as GCS requires)
+UPLOAD_CHUNK_SIZE = 8 * 256 * 1024
+# Files up to this size are buffered in memory before upload, larger ones on disk
+UPLOAD_SPOOL_SIZE = 1024 * 1024
+IMAGE_UPLOAD_WORKERS = int(os.environ.get('IMAGE_UPLOAD_WORKERS', 4))
+# Deferred deletes are retried this many times, backing off between attempts
+DELETE_ATTEMPTS = 3
+DELETE_RETRY_DELAY = 5
+
+
+class GCSImageStorage:
+    """Image storage in a Google Cloud Storage bucket, uploading with resumable chunked uploads"""
+
+    def __init__(self, bucket, chunk_size=UPLOAD_CHUNK_SIZE):
+        self.bucket = bucket
+        self.chunk_size = chunk_size
+
+    def upload(self, object_path, file_obj, content_type):
+        # Setting a chunk size makes the client stream the file as a resumable upload
+        blob = self.bucket.blob(object_path, chunk_size=self.chunk_size)
+        blob.upload_from_file(file_obj, content_type=content_type, rewind=True)
+
+    def delete(self, object_path):
+        blob = self.bucket.blob(object_path)
+        if blob.exists():
+            blob.delete()
+
+
+class LocalImageStorage:
+    """Filesystem stand-in for the bucket, for development and tests"""
+
+    def __init__(self, root, chunk_size=UPLOAD_CHUNK_SIZE):
+        self.root = root
+        self.chunk_size = chunk_size
+
+    def _path(self, object_path):
+        path = os.path.abspath(os.path.join(self.root, object_path))
+        if os.path.commonpath([path, os.path.abspath(self.root)]) != os.path.abspath(self.root):
+            raise ValueError(f"Object path escapes the storage root: {object_path}")
+        return path
+
+    def upload(self, object_path, file_obj, content_type):
+        path = self._path(object_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        file_obj.seek(0)
+        # Write next to the target and rename, so readers never see a partial file
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as target:
+                shutil.copyfileobj(file_obj, target, self.chunk_size)
+            os.replace(temp_path, path)
+        except Exception:
+            os.unlink(temp_path)
+            raise
+
+    def delete(self, object_path):
+        path = self._path(object_path)
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def create_image_storage(bucket):
+    """Use the local stand-in when IMAGE_STORAGE_DIR is set, the bucket otherwise"""
+    local_root = os.environ.get('IMAGE_STORAGE_DIR')
+    if local_root:
+        return LocalImageStorage(local_root)
+    return GCSImageStorage(bucket)
+
+
+class ImageUploadPipeline:
+    """
+    Uploads feature images on a thread pool and deletes replaced images in the background.
+
+    upload() copies the file out of the request and returns a Future right away, so
+    the request does not wait on object storage. Replaced images are not deleted
+    here: callers pass them to delete_later() once the upload succeeded and the row
+    referencing the new image is committed.
+    """
+
+    def __init__(self, storage, max_workers=IMAGE_UPLOAD_WORKERS):
+        self.storage = storage
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='image-upload')
+        self._deletes = queue.Queue()
+        self._cleanup_thread = None
+        self._lock = threading.Lock()
+
+    def upload(self, object_path, file_obj, content_type, cached_paths=()):
+        """
+        Start uploading a file.
+
+        Args:
+            object_path: Destination path in storage
+            file_obj: Readable file; its content is copied before this returns
+            content_type: MIME type stored with the object
+            cached_paths: Further signed URL cache keys to drop once uploaded
+
+        Returns:
+            Future resolving to object_path
+        """
+        spooled = tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_SIZE)
+        shutil.copyfileobj(file_obj, spooled, UPLOAD_CHUNK_SIZE)
+        spooled.seek(0)
+        return self._executor.submit(self._upload, object_path, spooled, content_type, cached_paths)
+
+    def _upload(self, object_path, spooled, content_type, cached_paths):
+        try:
+            self.storage.upload(object_path, spooled, content_type)
+        except Exception as e:
+            print(f"Error uploading image {object_path}: {str(e)}")
+            raise
+        finally:
+            spooled.close()
+
+        signed_url_cache.invalidate(object_path, *cached_paths)
+        print(f"Image uploaded to: {object_path}")
+        return object_path
+
+    def delete_later(self, object_path):
+        """Queue an object for deletion by the background cleanup thread"""
+        signed_url_cache.invalidate(object_path)
+        self._ensure_cleanup_thread()
+        self._deletes.put((object_path, 1))
+
+    def _ensure_cleanup_thread(self):
+        with self._lock:
+            if self._cleanup_thread is None or not self._cleanup_thread.is_alive():
+                self._cleanup_thread = threading.Thread(
+                    target=self._run_cleanup, name='image-cleanup', daemon=True
+                )
+                self._cleanup_thread.start()
+
+    def _run_cleanup(self):
+        while True:
+            object_path, attempt = self._deletes.get()
+            try:
+                self.storage.delete(object_path)
+                signed_url_cache.invalidate(object_path)
+                print(f"Deleted old image: {object_path}")
+            except Exception as e:
+                if attempt < DELETE_ATTEMPTS:
+                    time.sleep(DELETE_RETRY_DELAY * attempt)
+                    self._deletes.put((object_path, attempt + 1))
+                else:
+                    print(f"Warning: Could not delete old image {object_path}: {str(e)}")
+            finally:
+                self._deletes.task_done()
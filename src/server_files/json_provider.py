@@ -0,0 +1,64 @@
+# json_provider.py
+import dataclasses
+import decimal
+import uuid
+from datetime import date, datetime, time
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; the standard library encoder is used without it
+    orjson = None
+
+
+def _default(o):
+    """
+    Encode values the JSON encoder does not handle natively.
+
+    Dates and times are written as ISO-8601 strings, exactly as .isoformat() would,
+    so naive timestamps keep the format clients already parse.
+    """
+    if isinstance(o, (datetime, date, time)):
+        return o.isoformat()
+    if isinstance(o, (decimal.Decimal, uuid.UUID)):
+        return str(o)
+    if dataclasses.is_dataclass(o) and not isinstance(o, type):
+        return dataclasses.asdict(o)
+    if hasattr(o, "__html__"):
+        return str(o.__html__())
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """
+    JSON provider that encodes with orjson when it is installed.
+
+    Datetimes are serialized natively as ISO-8601 strings, so views can put them in
+    responses directly instead of calling .isoformat() on each one. Output matches the
+    standard library path: sorted keys, compact separators unless indenting in debug.
+    """
+    default = staticmethod(_default)
+
+    _ORJSON_OPTIONS = (orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS) if orjson else 0
+
+    def dumps(self, obj, **kwargs):
+        if orjson is None or not set(kwargs) <= {'indent', 'separators'}:
+            return super().dumps(obj, **kwargs)
+
+        option = self._ORJSON_OPTIONS
+        if kwargs.get('indent'):
+            option |= orjson.OPT_INDENT_2
+        try:
+            return orjson.dumps(obj, default=self.default, option=option).decode('utf-8')
+        except orjson.JSONEncodeError:
+            # e.g. integers beyond 64 bits, which the standard library still encodes
+            return super().dumps(obj, **kwargs)
+
+
+def register_json_provider(blueprint):
+    """Install FastJSONProvider on the application the blueprint is registered on"""
+    @blueprint.record_once
+    def install_json_provider(state):
+        if not isinstance(state.app.json, FastJSONProvider):
+            state.app.json = FastJSONProvider(state.app)
@@ -1,204 +1,128 @@
 # mobile_api.py
 
+import base64
+import binascii
+import hashlib
+import json
 from datetime import datetime, timezone
-from flask import request, jsonify, Blueprint
-from flask_jwt_extended import jwt_required, get_jwt_identity
-from geoalchemy2.shape import from_shape, to_shape
-from shapely import Point
+from itertools import groupby
+from flask import current_app, request, jsonify, make_response, Blueprint, Response, stream_with_context
+from sqlalchemy import func, select, tuple_
+from sqlalchemy.orm import selectinload
+from werkzeug.exceptions import HTTPException
 from website import db
+from website.blueprints.auth_decorators import flexible_login_required
+from website.blueprints.compression import register_compression
+from website.blueprints.json_provider import register_json_provider
+from website.blueprints.project_access import project_access_required
+from website.blueprints.spatial_filters import SpatialFilter
+from website.blueprints.sync_codec import decode_sync_request, is_msgpack_request, sync_response
+from website.blueprints.sync_engine import SYNC_BATCH_SIZE, apply_client_features, parse_iso_datetime
+from website.blueprints.sync_jobs import (
+    SYNC_JOB_RETRY_AFTER, create_sync_job, has_unfinished_job, lock_sync_order, sync_job_runner, wait_for_sync_job, wants_sync_job
+)
+from website.models.collected.collected_change_log_model import (
+    changed_attribute_keys, changed_feature_ids, current_revision
+)
 from website.models.collected.collected_features_model import CollectedFeatures
 from website.models.collected.collected_points_model import CollectedPoints
-from website.models.project.project_model import Project
-from dateutil import parser
+from website.models.collected.sync_batch_model import SyncBatch, IDEMPOTENCY_KEY_MAX_LENGTH
 
 mobile_api_bp = Blueprint('mobile_api', __name__)
+# Sync payloads are large and repetitive; compress both directions
+register_compression(mobile_api_bp, decompress_requests=True)
+register_json_provider(mobile_api_bp)
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+# attributesFormat value asking revision deltas to carry attribute merge patches
+ATTRIBUTES_MERGE_PATCH = 'merge-patch'
+
+# Page sizes for the keyset-paginated change feed
+CHANGE_FEED_PAGE_SIZE = 500
+CHANGE_FEED_MAX_PAGE_SIZE = 2000
 
 
 @mobile_api_bp.route('/<int:project_id>/sync', methods=['POST'])
-@jwt_required()
+@flexible_login_required
+@project_access_required
 def sync_project(project_id):
     """
     Improved endpoint for bi-directional synchronization of features between client and server.
     Handles creation, updates, and deletions with efficient timestamp-based tracking.
     """
     try:
-        # Get current user from JWT
-        current_user_id = get_jwt_identity()
-
-        # Validate project exists
-        project = Project.query.get(project_id)
-        if not project:
-            return jsonify({
-                "success": False,
-                "message": f"Project {project_id} not found"
-            }), 404
-
-        # Get data from request
-        data = request.json
+        # Get current user (project access was checked by the decorator)
+        current_user_id = request.current_user.id
+
+        # Newline-delimited requests are applied and answered as a stream
+        if request.mimetype == NDJSON_MIMETYPE:
+            return sync_project_ndjson(project_id, current_user_id)
+
+        # Get data from request, as MessagePack or JSON
+        if is_msgpack_request():
+            try:
+                data = decode_sync_request()
+            except ValueError as e:
+                return jsonify({
+                    "success": False,
+                    "message": str(e)
+                }), 415
+        else:
+            data = request.json
         if not data or not isinstance(data, dict):
             return jsonify({
                 "success": False,
                 "message": "Invalid request format"
             }), 400
 
-        # Get client features and last sync timestamp
-        client_features = data.get('features', [])
-        client_last_sync = data.get('lastSyncTimestamp')
-        
-        # Get client timezone if provided, default to UTC
-        client_timezone = data.get('timezone', 'UTC')
-
-        # Parse timestamp or default to epoch start
-        last_sync_time = parse_iso_datetime(client_last_sync) or datetime.utcfromtimestamp(0)
-
-        # Current server time for this sync operation
-        server_time = datetime.utcnow()
+        # Retried batches carry the same Idempotency-Key and get the stored response back
+        idempotency_key = request.headers.get('Idempotency-Key', '').strip() or None
+        if idempotency_key and len(idempotency_key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+            return jsonify({
+                "success": False,
+                "message": f"Idempotency-Key must be at most {IDEMPOTENCY_KEY_MAX_LENGTH} characters"
+            }), 400
+        request_hash = hashlib.sha256(request.get_data()).hexdigest() if idempotency_key else None
 
-        # Track processed features
-        processed_feature_ids = []
-        failed_feature_ids = []
+        if idempotency_key:
+            replay = replay_sync_batch(project_id, idempotency_key, request_hash)
+            if replay is not None:
+                return replay
 
         # Process client features in a batch transaction
         try:
-            # Process client features and their points
-            for feature_data in client_features:
-                client_id = feature_data.get('clientId')
-                if not client_id:
-                    continue
-
-                # Check if feature is marked as deleted
-                is_deleted = feature_data.get('deleted', False)
-
-                # If deleted, mark as inactive instead of actual deletion
-                if is_deleted:
-                    existing_feature = CollectedFeatures.query.filter_by(
-                        client_id=client_id,
-                        project_id=project_id
-                    ).first()
-
-                    if existing_feature:
-                        existing_feature.is_active = False
-                        existing_feature.updated_at = server_time
-                        existing_feature.updated_by = current_user_id
-                        processed_feature_ids.append(client_id)
-                    continue
-
-                # Get full feature data if not deleted
-                feature_full_data = feature_data.get('data', {})
-                if not feature_full_data:
-                    failed_feature_ids.append(client_id)
-                    continue
-                    
-                # Store timezone in attributes if not already present
-                feature_attributes = feature_full_data.get('attributes', {}) or {}
-                if 'timezone' not in feature_attributes:
-                    feature_attributes['timezone'] = client_timezone
-                feature_full_data['attributes'] = feature_attributes
-
-                # Check if feature exists
-                existing_feature = CollectedFeatures.query.filter_by(
-                    client_id=client_id,
-                    project_id=project_id
-                ).first()
-
-                if existing_feature:
-                    # Only update if client version is newer
-                    client_modified = parse_iso_datetime(feature_data.get('lastModified'))
-                    if client_modified and client_modified > existing_feature.updated_at:
-                        # Update existing feature
-                        existing_feature.name = feature_full_data.get('name', existing_feature.name)
-                        existing_feature.draw_layer = feature_full_data.get('draw_layer', existing_feature.draw_layer)
-                        existing_feature.type = feature_full_data.get('type', existing_feature.type)
-                        existing_feature.attributes = feature_attributes
-                        existing_feature.updated_at = server_time
-                        existing_feature.updated_by = current_user_id
-                        feature = existing_feature
-                    else:
-                        # Server version is newer, skip update
-                        feature = existing_feature
-                else:
-                    # Create new feature
-                    feature = CollectedFeatures(
-                        client_id=client_id,
-                        draw_layer=feature_full_data.get('draw_layer'),
-                        type=feature_full_data.get('type'),
-                        name=feature_full_data.get('name'),
-                        project_id=project_id,
-                        attributes=feature_attributes,
-                        created_by=current_user_id,
-                        created_at=parse_iso_datetime(feature_full_data.get('created_at')) or server_time,
-                        updated_at=server_time,
-                        updated_by=current_user_id,
-                        is_active=True
-                    )
-                    db.session.add(feature)
-                    db.session.flush()  # Get the feature ID
-
-                # Process points for this feature
-                points_data = feature_full_data.get('points', [])
-                for point_data in points_data:
-                    point_client_id = point_data.get('client_id')
-                    if not point_client_id:
-                        continue
-
-                    # Check if point exists
-                    existing_point = CollectedPoints.query.filter_by(
-                        client_id=point_client_id,
-                        feature_id=feature.id
-                    ).first()
-
-                    # Get coordinates, defaulting to [0,0] if invalid
-                    coords = point_data.get('coords', [0, 0])
-                    if not isinstance(coords, list) or len(coords) < 2:
-                        coords = [0, 0]
-
-                    point_geom = Point(coords[0], coords[1])
-                    
-                    # Store timezone in point attributes if not already present
-                    point_attributes = point_data.get('attributes', {}) or {}
-                    if 'timezone' not in point_attributes:
-                        point_attributes['timezone'] = client_timezone
-                    
-                    if existing_point:
-                        # Update existing point
-                        existing_point.coords = from_shape(point_geom, srid=4326)
-                        existing_point.fcode = point_data.get('fcode', existing_point.fcode)
-                        existing_point.attributes = point_attributes
-                        existing_point.updated_at = server_time
-                        existing_point.updated_by = current_user_id
-                    else:
-                        # Create new point
-                        new_point = CollectedPoints(
-                            client_id=point_client_id,
-                            fcode=point_data.get('fcode', ''),
-                            coords=from_shape(point_geom, srid=4326),
-                            attributes=point_attributes,
-                            project_id=project_id,
-                            feature_id=feature.id,
-                            created_by=current_user_id,
-                            created_at=parse_iso_datetime(point_data.get('created_at')) or server_time,
-                            updated_at=server_time,
-                            updated_by=current_user_id,
-                            is_active=True
-                        )
-                        db.session.add(new_point)
-
-                processed_feature_ids.append(client_id)
-
-            # Fetch server changes since last sync
-            server_changes = get_server_changes_since(project_id, last_sync_time, current_user_id)
+            batch = None
+            if idempotency_key:
+                batch = SyncBatch.claim(project_id, idempotency_key, current_user_id, request_hash)
+                if batch is None:
+                    # A concurrent attempt with the same key committed first
+                    db.session.rollback()
+                    return replay_sync_batch(project_id, idempotency_key, request_hash)
+
+            # Batches of a project apply in arrival order, so queue behind any unfinished job
+            lock_sync_order(project_id)
+
+            # Oversized batches are applied in the background; the client polls for the result
+            if wants_sync_job(data) or has_unfinished_job(project_id):
+                job = create_sync_job(project_id, current_user_id, data)
+                payload, status = {
+                    "success": True,
+                    "jobId": job.id,
+                    "status": job.status
+                }, 202
+            else:
+                payload, status = apply_sync_request(project_id, data, current_user_id), 200
+
+            # The stored outcome is committed together with the changes
+            if batch is not None:
+                batch.store_response(payload, status)
 
             # Commit all changes
             db.session.commit()
 
-            return jsonify({
-                "success": True,
-                "processed": processed_feature_ids,
-                "failed": failed_feature_ids,
-                "changes": server_changes,
-                "serverTimestamp": server_time.isoformat()
-            }), 200
-
+        except HTTPException:
+            db.session.rollback()
+            raise
         except Exception as e:
             db.session.rollback()
             return jsonify({
@@ -206,6 +130,132 @@ def sync_project(project_id):
                 "message": f"Database error: {str(e)}"
             }), 500
 
+        if status == 202:
+            try:
+                sync_job_runner.submit(project_id)
+            except Exception as e:
+                # The job is committed and is picked up when the runner next starts
+                print(f"Error scheduling sync job for project {project_id}: {str(e)}")
+            return jsonify(payload), status
+        return sync_response(payload, status)
+
+    except HTTPException:
+        # Request errors such as an oversized or undecodable body keep their status
+        raise
+    except Exception as e:
+        return jsonify({
+            "success": False,
+            "message": f"Server error: {str(e)}"
+        }), 500
+
+
+def replay_sync_batch(project_id, idempotency_key, request_hash):
+    """
+    Build the response for a batch whose Idempotency-Key was already used.
+
+    Returns:
+        The stored response, an error if the key was used for a different request,
+        or None if the key has not been used
+    """
+    batch = SyncBatch.find(project_id, idempotency_key)
+    if batch is None:
+        return None
+
+    if batch.request_hash != request_hash:
+        return jsonify({
+            "success": False,
+            "message": "Idempotency-Key was already used for a different request"
+        }), 422
+
+    if batch.status_code == 202:
+        response = jsonify(batch.response)
+        response.status_code = 202
+    else:
+        response = sync_response(batch.response, batch.status_code)
+    response = make_response(response)
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def apply_sync_request(project_id, data, current_user_id):
+    """
+    Apply a sync request body and build the sync response, without committing.
+
+    Used by the sync endpoint and by background sync jobs, which commit the result
+    together with the job status.
+
+    Args:
+        project_id: The project ID
+        data: Sync request body (features, lastSyncTimestamp, lastRevision, timezone)
+        current_user_id: ID of the user the changes are attributed to
+
+    Returns:
+        Sync response payload
+    """
+    # Get client features and last sync timestamp
+    client_features = data.get('features', [])
+    client_last_sync = data.get('lastSyncTimestamp')
+
+    # Get client timezone if provided, default to UTC
+    client_timezone = data.get('timezone', 'UTC')
+
+    # Parse timestamp or default to epoch start
+    last_sync_time = parse_iso_datetime(client_last_sync) or datetime.utcfromtimestamp(0)
+
+    # Revision-based clients send the last revision they saw instead of a timestamp
+    last_revision = parse_revision(data.get('lastRevision'))
+    attribute_patches = data.get('attributesFormat') == ATTRIBUTES_MERGE_PATCH
+
+    # Current server time for this sync operation
+    server_time = datetime.utcnow()
+
+    # Apply client features and their points with set-based statements
+    processed_feature_ids, failed_feature_ids, elided = apply_client_features(
+        project_id, client_features, current_user_id, client_timezone, server_time
+    )
+
+    # Fetch server changes since last sync
+    server_revision = current_revision(project_id)
+    if last_revision is not None:
+        server_changes = list(iter_server_changes_since_revision(project_id, last_revision, server_revision,
+                                                                 attribute_patches))
+    else:
+        server_changes = get_server_changes_since(project_id, last_sync_time, current_user_id)
+
+    return {
+        "success": True,
+        "processed": processed_feature_ids,
+        "failed": failed_feature_ids,
+        "elided": elided,
+        "changes": server_changes,
+        "serverTimestamp": server_time,
+        "serverRevision": server_revision
+    }
+
+
+@mobile_api_bp.route('/<int:project_id>/sync/jobs/<int:job_id>', methods=['GET'])
+@flexible_login_required
+@project_access_required
+def get_sync_job(project_id, job_id):
+    """
+    Status of a background sync job; pass wait=<seconds> to long-poll for completion.
+
+    Once completed, result holds the same payload the synchronous endpoint returns.
+    """
+    try:
+        wait = request.args.get('wait', 0, type=float)
+        job = wait_for_sync_job(job_id, project_id, wait)
+        if job is None:
+            return jsonify({
+                "success": False,
+                "message": f"Sync job {job_id} not found"
+            }), 404
+
+        return jsonify({
+            "success": True,
+            **job.to_dict()
+        }), 200
+
     except Exception as e:
         return jsonify({
             "success": False,
@@ -225,6 +275,23 @@ def get_server_changes_since(project_id, last_sync_time, current_user_id):
     Returns:
         List of changed features with their points
     """
+    return list(iter_server_changes(project_id, last_sync_time))
+
+
+def iter_server_changes(project_id, last_sync_time):
+    """
+    Yield features that have changed since the last sync, one at a time.
+
+    Rows are read through a server-side cursor in SYNC_BATCH_SIZE batches, so memory
+    use does not depend on how many features changed.
+
+    Args:
+        project_id: The project ID
+        last_sync_time: Datetime object representing last sync time
+
+    Yields:
+        Changed features with their points, in the sync response format
+    """
     # Ensure last_sync_time is timezone-aware UTC time for consistent comparison
     if last_sync_time.tzinfo is None:
         # If naive, assume it's UTC
@@ -236,89 +303,361 @@ def get_server_changes_since(project_id, last_sync_time, current_user_id):
     # Query features updated since last sync
     query = db.session.query(CollectedFeatures) \
         .filter(CollectedFeatures.project_id == project_id) \
-        .filter(CollectedFeatures.updated_at > last_sync_time)
-
-    # Format server features for response
-    changes = []
-    for feature in query.all():
-        # Get active points for this feature
-        feature_points = []
-        for point in feature.points:
-            if point.is_active:
-                point_geom = to_shape(point.coords)
-                feature_points.append({
-                    "client_id": point.client_id,
-                    "fcode": point.fcode,
-                    "coords": [point_geom.x, point_geom.y],
-                    "attributes": point.attributes,
-                    "created_by": point.created_by,
-                    "created_at": point.created_at.isoformat() if point.created_at else None,
-                    "updated_by": point.updated_by,
-                    "updated_at": point.updated_at.isoformat() if point.updated_at else None,
-                    "is_active": point.is_active,
-                    "timezone": point.attributes.get("timezone", "UTC") if point.attributes else "UTC"
-                })
+        .filter(CollectedFeatures.updated_at > last_sync_time) \
+        .options(selectinload(CollectedFeatures.active_points)) \
+        .yield_per(SYNC_BATCH_SIZE)
 
+    for feature in query:
         # Only include active features or those marked inactive since last sync
         if feature.is_active or feature.updated_at > last_sync_time:
-            changes.append({
-                "clientId": feature.client_id,
-                "lastModified": feature.updated_at.isoformat() if feature.updated_at else None,
-                "deleted": not feature.is_active,
-                "data": {
-                    "name": feature.name,
-                    "draw_layer": feature.draw_layer,
-                    "type": feature.type,
-                    "project_id": feature.project_id,
-                    "attributes": feature.attributes,
-                    "created_by": feature.created_by,
-                    "created_at": feature.created_at.isoformat() if feature.created_at else None,
-                    "updated_by": feature.updated_by,
-                    "updated_at": feature.updated_at.isoformat() if feature.updated_at else None,
-                    "points": feature_points if feature.is_active else [],
-                    "timezone": feature.attributes.get("timezone", "UTC") if feature.attributes else "UTC"
-                }
-            })
+            yield serialize_feature_change(feature)
 
-    return changes
 
+def iter_server_changes_since_revision(project_id, last_revision, server_revision, attribute_patches=False):
+    """
+    Yield features written after a given project revision, one at a time.
+
+    The changed feature IDs come from a single range scan of the change log, bounded
+    by server_revision so that the client can safely resume from it next time.
+
+    Args:
+        project_id: The project ID
+        last_revision: Last revision the client has seen
+        server_revision: Revision reported back to the client in this response
+        attribute_patches: Send attributes as merge patches of the keys changed in the range
+
+    Yields:
+        Changed features with their points, in the sync response format
+    """
+    changed_keys = None
+    if attribute_patches:
+        changed_keys = changed_attribute_keys(project_id, last_revision, server_revision)
+
+    query = db.session.query(CollectedFeatures) \
+        .filter(CollectedFeatures.project_id == project_id) \
+        .filter(CollectedFeatures.id.in_(changed_feature_ids(project_id, last_revision, server_revision))) \
+        .order_by(CollectedFeatures.id) \
+        .options(selectinload(CollectedFeatures.active_points)) \
+        .yield_per(SYNC_BATCH_SIZE)
 
-def parse_iso_datetime(datetime_str):
-    """Convert ISO format datetime string to a Python datetime in UTC"""
-    if not datetime_str or not isinstance(datetime_str, str):
+    for feature in query:
+        yield serialize_feature_change(feature, changed_keys)
+
+
+def parse_revision(value):
+    """Parse a client-supplied revision number, returning None if absent or invalid"""
+    if value is None or isinstance(value, bool):
         return None
+    try:
+        revision = int(value)
+    except (TypeError, ValueError):
+        return None
+    return revision if revision >= 0 else None
+
+
+def serialize_feature_change(feature, changed_keys=None):
+    """
+    Format a feature and its active points as a sync change entry.
+
+    Args:
+        feature: The feature, with active_points loaded
+        changed_keys: Result of changed_attribute_keys() for the client's revision range;
+            when given, attributes are sent as an attributesPatch of the changed keys
+            wherever the writes in the range were merge patches
+    """
+    # Active points only; callers load them with selectinload(CollectedFeatures.active_points)
+    feature_points = []
+    for point in feature.active_points:
+        feature_points.append({
+            "client_id": point.client_id,
+            "fcode": point.fcode,
+            "coords": [point.longitude, point.latitude],
+            **serialize_attributes('point', point.id, point.attributes, changed_keys),
+            "created_by": point.created_by,
+            "created_at": point.created_at,
+            "updated_by": point.updated_by,
+            "updated_at": point.updated_at,
+            "is_active": point.is_active,
+            "timezone": point.attributes.get("timezone", "UTC") if point.attributes else "UTC"
+        })
+
+    return {
+        "clientId": feature.client_id,
+        "lastModified": feature.updated_at,
+        "deleted": not feature.is_active,
+        "data": {
+            "name": feature.name,
+            "draw_layer": feature.draw_layer,
+            "type": feature.type,
+            "project_id": feature.project_id,
+            **serialize_attributes('feature', feature.id, feature.attributes, changed_keys),
+            "created_by": feature.created_by,
+            "created_at": feature.created_at,
+            "updated_by": feature.updated_by,
+            "updated_at": feature.updated_at,
+            "points": feature_points if feature.is_active else [],
+            "timezone": feature.attributes.get("timezone", "UTC") if feature.attributes else "UTC"
+        }
+    }
+
+
+def serialize_attributes(entity_type, entity_id, attributes, changed_keys):
+    """Attributes of a change entry, whole or as a merge patch holding only the changed keys"""
+    if changed_keys is None:
+        return {"attributes": attributes}
+
+    entity = (entity_type, entity_id)
+    if entity in changed_keys and changed_keys[entity] is None:
+        return {"attributes": attributes}
+
+    # Keys removed since the client's revision are sent as null, as merge patch requires
+    attributes = attributes or {}
+    return {"attributesPatch": {key: attributes.get(key) for key in sorted(changed_keys.get(entity, ()))}}
+
+
+def sync_project_ndjson(project_id, current_user_id):
+    """
+    Streaming variant of the sync endpoint, used when the request is sent as NDJSON.
+
+    Each request line is one feature in the regular sync format and is applied in
+    chunks of SYNC_BATCH_SIZE. lastSyncTimestamp and timezone are passed as query
+    parameters. The response starts with a summary line followed by one line per
+    server change, generated from a server-side cursor.
+    """
+    client_timezone = request.args.get('timezone', 'UTC')
+    last_sync_time = parse_iso_datetime(request.args.get('lastSyncTimestamp')) or datetime.utcfromtimestamp(0)
+    last_revision = parse_revision(request.args.get('lastRevision'))
+    attribute_patches = request.args.get('attributesFormat') == ATTRIBUTES_MERGE_PATCH
+    server_time = datetime.utcnow()
+
+    processed_feature_ids = []
+    failed_feature_ids = []
+    elided = 0
 
     try:
-        dt = parser.isoparse(datetime_str)
-        # Convert to UTC if timezone info exists
-        if dt.tzinfo is not None:
-            dt = dt.astimezone(timezone.utc)
+        # Streamed batches cannot be queued, so they wait for the project's jobs instead
+        lock_sync_order(project_id)
+        if has_unfinished_job(project_id):
+            db.session.rollback()
+            response = jsonify({
+                "success": False,
+                "message": "Earlier sync jobs of this project are still being applied"
+            })
+            response.status_code = 409
+            response.headers['Retry-After'] = str(SYNC_JOB_RETRY_AFTER)
+            return response
+
+        chunk = []
+        for line in request.stream:
+            line = line.strip()
+            if not line:
+                continue
+            feature_data = json.loads(line)
+            if not isinstance(feature_data, dict):
+                raise ValueError("Each line must be a JSON object")
+            chunk.append(feature_data)
+
+            if len(chunk) >= SYNC_BATCH_SIZE:
+                processed, failed, chunk_elided = apply_client_features(
+                    project_id, chunk, current_user_id, client_timezone, server_time
+                )
+                processed_feature_ids.extend(processed)
+                failed_feature_ids.extend(failed)
+                elided += chunk_elided
+                chunk = []
+
+        if chunk:
+            processed, failed, chunk_elided = apply_client_features(
+                project_id, chunk, current_user_id, client_timezone, server_time
+            )
+            processed_feature_ids.extend(processed)
+            failed_feature_ids.extend(failed)
+            elided += chunk_elided
+
+        server_revision = current_revision(project_id)
+        db.session.commit()
+
+    except HTTPException:
+        db.session.rollback()
+        raise
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({
+            "success": False,
+            "message": f"Invalid request format: {str(e)}"
+        }), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({
+            "success": False,
+            "message": f"Database error: {str(e)}"
+        }), 500
+
+    def generate():
+        yield current_app.json.dumps({
+            "success": True,
+            "processed": processed_feature_ids,
+            "failed": failed_feature_ids,
+            "elided": elided,
+            "serverTimestamp": server_time,
+            "serverRevision": server_revision
+        }) + "\n"
+
+        if last_revision is not None:
+            changes = iter_server_changes_since_revision(project_id, last_revision, server_revision,
+                                                         attribute_patches)
         else:
-            # If no timezone info, assume it's already UTC
-            # but we don't add timezone info to avoid db comparison issues
-            pass
-        return dt
-    except (ValueError, TypeError):
-        return None
+            changes = iter_server_changes(project_id, last_sync_time)
+
+        try:
+            for change in changes:
+                yield current_app.json.dumps(change) + "\n"
+        except Exception as e:
+            # Headers are already sent, so report the failure in-band
+            yield current_app.json.dumps({
+                "success": False,
+                "message": f"Server error: {str(e)}"
+            }) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype=NDJSON_MIMETYPE)
+
+
+@mobile_api_bp.route('/<int:project_id>/changes', methods=['GET'])
+@flexible_login_required
+@project_access_required
+def get_change_feed(project_id):
+    """
+    Keyset-paginated feed of feature changes ordered by (updated_at, id).
+
+    Each page carries an opaque cursor that resumes the feed right after the last
+    returned change. Without a cursor the feed starts at lastSyncTimestamp, or at
+    the beginning of the project when that is not given either.
+    """
+    try:
+        limit = request.args.get('limit', CHANGE_FEED_PAGE_SIZE, type=int)
+        limit = max(1, min(limit, CHANGE_FEED_MAX_PAGE_SIZE))
+
+        cursor = request.args.get('cursor')
+        if cursor:
+            try:
+                position = decode_change_cursor(cursor)
+            except ValueError:
+                return jsonify({"success": False, "error": "Invalid cursor"}), 400
+        else:
+            since = parse_iso_datetime(request.args.get('lastSyncTimestamp')) or datetime.utcfromtimestamp(0)
+            if since.tzinfo is None:
+                since = since.replace(tzinfo=timezone.utc)
+            position = (since, 0)
+
+        server_time = datetime.utcnow()
+
+        # One extra row tells us whether another page follows
+        features = CollectedFeatures.query.filter(
+            CollectedFeatures.project_id == project_id,
+            tuple_(CollectedFeatures.updated_at, CollectedFeatures.id) > tuple_(*position)
+        ).order_by(
+            CollectedFeatures.updated_at, CollectedFeatures.id
+        ).options(
+            selectinload(CollectedFeatures.active_points)
+        ).limit(limit + 1).all()
+
+        has_more = len(features) > limit
+        features = features[:limit]
+
+        if features:
+            last = features[-1]
+            position = (last.updated_at, last.id)
+
+        return jsonify({
+            "success": True,
+            "changes": [serialize_feature_change(feature) for feature in features],
+            "cursor": encode_change_cursor(*position),
+            "hasMore": has_more,
+            "serverTimestamp": server_time
+        }), 200
+
+    except Exception as e:
+        return jsonify({
+            "success": False,
+            "error": f"Server error: {str(e)}"
+        }), 500
+
+
+def encode_change_cursor(updated_at, feature_id):
+    """Encode a change feed position as an opaque URL-safe token"""
+    payload = json.dumps({"u": updated_at.isoformat(), "i": feature_id}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_change_cursor(cursor):
+    """Decode a change feed token back into an (updated_at, id) position"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        updated_at = parse_iso_datetime(payload['u'])
+        feature_id = int(payload['i'])
+    except (TypeError, KeyError, UnicodeError, binascii.Error, json.JSONDecodeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+    if updated_at is None:
+        raise ValueError(f"Invalid cursor: {cursor}")
+    if updated_at.tzinfo is None:
+        updated_at = updated_at.replace(tzinfo=timezone.utc)
+    return updated_at, feature_id
 
 
 @mobile_api_bp.route('/<int:project_id>/active-features', methods=['GET'])
-@jwt_required()
+@flexible_login_required
+@project_access_required
 def get_active_features(project_id):
-    """Endpoint to retrieve all active features and their points for a project"""
+    """Endpoint to retrieve all active features and their points for a project, optionally within a bbox or radius"""
     try:
-        # Validate project exists
-        project = Project.query.get(project_id)
-        if not project:
-            return jsonify({"success": False, "error": f"Project {project_id} not found"}), 404
-
-        # Query all active features for this project
-        features = CollectedFeatures.query.filter_by(
-            project_id=project_id,
-            is_active=True
-        ).all()
-
-        if not features:
+        try:
+            spatial_filter = SpatialFilter.from_args(request.args)
+        except ValueError as e:
+            return jsonify({
+                "success": False,
+                "message": str(e)
+            }), 400
+
+        # Load all active features with their active points in a single query,
+        # extracting the coordinates in SQL
+        query = db.session.query(
+            CollectedFeatures.id,
+            CollectedFeatures.client_id,
+            CollectedFeatures.name,
+            CollectedFeatures.created_at,
+            CollectedFeatures.created_by,
+            CollectedPoints.client_id.label('point_client_id'),
+            func.ST_X(CollectedPoints.coords).label('longitude'),
+            func.ST_Y(CollectedPoints.coords).label('latitude'),
+            CollectedPoints.attributes.label('point_attributes'),
+            CollectedPoints.created_at.label('point_created_at'),
+            CollectedPoints.created_by.label('point_created_by')
+        ).join(
+            CollectedPoints, CollectedPoints.feature_id == CollectedFeatures.id
+        ).filter(
+            CollectedFeatures.project_id == project_id,
+            CollectedFeatures.is_active == True,
+            CollectedPoints.project_id == project_id,
+            CollectedPoints.is_active == True
+        )
+
+        if spatial_filter:
+            # Features with any active point in the area, found through the active-points GiST index;
+            # all of their points are returned so that lines and polygons stay whole
+            query = query.filter(CollectedFeatures.id.in_(
+                select(CollectedPoints.feature_id).where(
+                    CollectedPoints.project_id == project_id,
+                    CollectedPoints.is_active == True,
+                    spatial_filter.condition(CollectedPoints.coords)
+                )
+            ))
+
+        rows = query.order_by(CollectedFeatures.id, CollectedPoints.id).all()
+
+        # Only features that have active points are returned by the join
+        if not rows:
             return jsonify({
                 "success": True,
                 "features": [],
@@ -327,39 +666,24 @@ def get_active_features(project_id):
 
         result = []
 
-        # For each feature, get its points and structure the response
-        for feature in features:
-            # Get all active points for this feature
-            points = CollectedPoints.query.filter_by(
-                feature_id=feature.id,
-                project_id=project_id,
-                is_active=True
-            ).all()
-
-            # Format points with coordinates
-            formatted_points = []
-            for point in points:
-                # Convert geometry to coordinates
-                wkb_element = to_shape(point.coords)
-                longitude, latitude = wkb_element.x, wkb_element.y
-
-                formatted_points.append({
-                    "client_id": point.client_id,
-                    "coordinates": [longitude, latitude],
-                    "attributes": point.attributes,
-                    "created_at": point.created_at.isoformat() if point.created_at else None,
-                    "created_by": point.created_by
-                })
-
-            # Only add features that have active points
-            if formatted_points:
-                result.append({
-                    "client_id": feature.client_id,
-                    "name": feature.name,
-                    "created_at": feature.created_at.isoformat() if feature.created_at else None,
-                    "created_by": feature.created_by,
-                    "points": formatted_points
-                })
+        # Rows are ordered by feature, so each group holds one feature and its points
+        for _, feature_rows in groupby(rows, key=lambda row: row.id):
+            feature_rows = list(feature_rows)
+            feature = feature_rows[0]
+
+            result.append({
+                "client_id": feature.client_id,
+                "name": feature.name,
+                "created_at": feature.created_at,
+                "created_by": feature.created_by,
+                "points": [{
+                    "client_id": point.point_client_id,
+                    "coordinates": [point.longitude, point.latitude],
+                    "attributes": point.point_attributes,
+                    "created_at": point.point_created_at,
+                    "created_by": point.point_created_by
+                } for point in feature_rows]
+            })
 
         return jsonify({
             "success": True,
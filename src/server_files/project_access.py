@@ -0,0 +1,119 @@
+# project_access.py
+import threading
+import time
+from functools import wraps
+
+from flask import request, jsonify
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from website import db
+from website.models.project.project_model import Project
+from website.models.project.project_technician_model import ProjectTechnician
+
+# How long a resolved (user, project) decision is reused, in seconds
+PROJECT_ACCESS_TTL = 60
+
+ACCESS_ALLOWED = 200
+ACCESS_FORBIDDEN = 403
+ACCESS_NOT_FOUND = 404
+
+
+class ProjectAccessCache:
+    """
+    Short-lived, process-local cache of (user, project) access decisions.
+
+    Entries for a project are dropped as soon as that project is edited in this
+    worker; other workers pick up the change within PROJECT_ACCESS_TTL.
+    """
+
+    def __init__(self, ttl=PROJECT_ACCESS_TTL):
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, user_id, project_id):
+        with self._lock:
+            entry = self._entries.get((user_id, project_id))
+        if entry and entry[1] > time.monotonic():
+            return entry[0]
+        return None
+
+    def set(self, user_id, project_id, status):
+        with self._lock:
+            self._entries[(user_id, project_id)] = (status, time.monotonic() + self.ttl)
+
+    def invalidate_project(self, project_id):
+        with self._lock:
+            for key in [key for key in self._entries if key[1] == project_id]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+project_access_cache = ProjectAccessCache()
+
+
+def resolve_project_access(user, project_id):
+    """
+    Decide whether a user may access a project.
+
+    Admins may access any existing project, everyone else only the projects they are
+    assigned to as technician.
+
+    Returns:
+        ACCESS_ALLOWED, ACCESS_FORBIDDEN or ACCESS_NOT_FOUND
+    """
+    status = project_access_cache.get(user.id, project_id)
+    if status is not None:
+        return status
+
+    if db.session.query(Project.id).filter(Project.id == project_id).scalar() is None:
+        status = ACCESS_NOT_FOUND
+    elif user.role == 'Admin' or ProjectTechnician.is_member(project_id, user.employee_id):
+        status = ACCESS_ALLOWED
+    else:
+        status = ACCESS_FORBIDDEN
+
+    project_access_cache.set(user.id, project_id, status)
+    return status
+
+
+def project_access_required(view):
+    """
+    Reject requests for projects the current user may not access.
+
+    Must be applied below flexible_login_required, which sets request.current_user,
+    on routes that take a project_id argument.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        project_id = kwargs['project_id']
+        status = resolve_project_access(request.current_user, project_id)
+
+        if status == ACCESS_NOT_FOUND:
+            message = f"Project {project_id} not found"
+        elif status == ACCESS_FORBIDDEN:
+            message = 'Unauthorized access'
+        else:
+            return view(*args, **kwargs)
+
+        return jsonify({
+            'success': False,
+            'error': message,
+            'message': message
+        }), status
+
+    return wrapper
+
+
+@event.listens_for(Session, 'after_flush')
+def invalidate_project_access(session, flush_context):
+    """Drop cached decisions for projects that were edited or deleted"""
+    for obj in list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Project):
+            project_access_cache.invalidate_project(obj.id)
+        elif isinstance(obj, ProjectTechnician):
+            project_access_cache.invalidate_project(obj.project_id)
@@ -0,0 +1,90 @@
+# project_technician_model.py
+from sqlalchemy import event, exists, inspect
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from website import db
+
+
+class ProjectTechnician(db.Model):
+    """
+    Indexed technician-to-project membership.
+
+    Mirrors the comma-separated Project.technicians column so that project listings
+    and access checks are index lookups instead of LIKE scans. Rows are kept in step
+    with the column by the flush listener below.
+    """
+    __table_args__ = (
+        # Project listing for a technician
+        db.Index('ix_project_technician_employee_project', 'employee_id', 'project_id'),
+    )
+
+    project_id = db.Column(db.Integer, db.ForeignKey('project.id', ondelete='CASCADE'), primary_key=True)
+    employee_id = db.Column(db.String(20), primary_key=True)
+
+    def __repr__(self):
+        return f'<ProjectTechnician {self.employee_id} on {self.project_id}>'
+
+    @staticmethod
+    def parse_technicians(technicians):
+        """Split a comma-separated technicians string into unique employee IDs"""
+        if not technicians:
+            return []
+        employee_ids = []
+        for employee_id in str(technicians).split(','):
+            employee_id = employee_id.strip()
+            if employee_id and employee_id not in employee_ids:
+                employee_ids.append(employee_id)
+        return employee_ids
+
+    @classmethod
+    def is_member(cls, project_id, employee_id):
+        """Check whether an employee is assigned to a project"""
+        return db.session.query(exists().where(
+            cls.project_id == project_id,
+            cls.employee_id == str(employee_id)
+        )).scalar()
+
+    @classmethod
+    def replace_for_project(cls, connection, project_id, technicians):
+        """Replace a project's membership rows with the employees in a technicians string"""
+        connection.execute(db.delete(cls).where(cls.project_id == project_id))
+        rows = [{'project_id': project_id, 'employee_id': employee_id}
+                for employee_id in cls.parse_technicians(technicians)]
+        if rows:
+            connection.execute(insert(cls).values(rows).on_conflict_do_nothing())
+
+    @classmethod
+    def backfill_from_projects(cls, batch_size=1000):
+        """
+        Populate membership rows from the existing Project.technicians strings.
+
+        Safe to run more than once. Run it on deploy with
+        `flask projects backfill-technicians`.
+
+        Returns:
+            Number of projects processed
+        """
+        from website.models.project.project_model import Project
+
+        connection = db.session.connection()
+        count = 0
+        query = db.session.query(Project.id, Project.technicians).yield_per(batch_size)
+        for project_id, technicians in query:
+            cls.replace_for_project(connection, project_id, technicians)
+            count += 1
+        db.session.commit()
+        return count
+
+
+@event.listens_for(Session, 'after_flush')
+def sync_project_technicians(session, flush_context):
+    """Keep membership rows in step with Project.technicians on every insert or update"""
+    from website.models.project.project_model import Project
+
+    for obj in list(session.new) + list(session.dirty):
+        if not isinstance(obj, Project):
+            continue
+        if obj in session.dirty and not inspect(obj).attrs.technicians.history.has_changes():
+            continue
+        ProjectTechnician.replace_for_project(session.connection(), obj.id, obj.technicians)
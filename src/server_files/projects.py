@@ -4,20 +4,28 @@ from datetime import datetime, timezone
 
 import pytz
 from dateutil import parser
-from flask import Blueprint, render_template, request, flash, jsonify, redirect, url_for, session
+from flask import Blueprint, render_template, request, flash, jsonify, redirect, url_for, session, make_response
 from flask_login import login_required, current_user
-from geoalchemy2.shape import to_shape, from_shape
+from geoalchemy2.shape import from_shape
 from google.cloud import storage
 from google.oauth2 import service_account
 from shapely import Point
-from sqlalchemy import or_, and_
+from sqlalchemy import func
+from sqlalchemy.orm import selectinload
 from website import db
 from website.blueprints.auth_decorators import flexible_login_required
+from website.blueprints.feature_catalog import catalog_snapshots, feature_catalog_version
+from website.blueprints.feature_images import feature_image_path, signed_url_cache
+from website.blueprints.json_provider import register_json_provider
+from website.blueprints.project_access import project_access_required
 from website.forms import ProjectForm
+from website.models.collected.collected_change_log_model import changed_feature_ids, current_revision
 from website.models.collected.collected_features_model import CollectedFeatures
 from website.models.collected.collected_points_model import CollectedPoints
+from website.models.collected.content_hash import feature_content_hash, point_content_hash
 from website.models.feature.feature_model import Feature
 from website.models.project.project_model import Project
+from website.models.project.project_technician_model import ProjectTechnician
 from website.models.worktype_model import worktype_features, WorkType
 
 key_path = os.environ.get('GOOGLE_APPLICATION_CREDENTIALS')
@@ -34,6 +42,7 @@ bucket_name = os.environ.get("APP_BUCKET_NAME")
 bucket = storage_client.bucket(bucket_name)
 
 projects_bp = Blueprint('projects', __name__)
+register_json_provider(projects_bp)
 
 
 @projects_bp.route('/openproject/', methods=['GET'])
@@ -58,20 +67,14 @@ def display_projects():
             ).order_by(Project.date.desc()).all()
         else:
             employee_id = current_user.employee_id
-            employee_id_pattern = f"%{employee_id},%"
-            employee_id_end_pattern = f"%{employee_id}"
 
             print(f"Searching for employee ID: {employee_id}")  # Debug print
 
-            projects = Project.query.filter(
-                and_(
-                    or_(
-                        Project.technicians.like(employee_id_pattern),
-                        Project.technicians.like(employee_id_end_pattern),
-                        Project.technicians == employee_id
-                    ),
-                    Project.is_active == True
-                )
+            projects = Project.query.join(
+                ProjectTechnician, ProjectTechnician.project_id == Project.id
+            ).filter(
+                ProjectTechnician.employee_id == str(employee_id),
+                Project.is_active == True
             ).order_by(Project.date.desc()).all()
 
         print(f"Found {len(projects)} projects")  # Debug print
@@ -171,86 +174,35 @@ def set_session():
 # this endpoing gets feature types
 @projects_bp.route('/projects/<int:project_id>/feature_types', methods=['GET'])
 @flexible_login_required
+@project_access_required
 def get_project_feature_types(project_id):
     try:
         project = Project.query.options(
             db.joinedload(Project.work_type)
         ).get_or_404(project_id)
 
-        # Check if user has access to this project
-        user = request.current_user
-        if user.role != 'Admin':
-            employee_id = user.employee_id
-            if str(employee_id) not in project.technicians.split(','):
-                return jsonify({
-                    'success': False,
-                    'error': 'Unauthorized access'
-                }), 403
-
         if not project.work_type:
             return jsonify({
                 'success': True,
                 'features': []
             })
 
-        # Get features for the project's work type
-        features = Feature.query.join(worktype_features).filter(
-            worktype_features.c.worktype_id == project.work_type_id
-        ).all()
-
-        # Import datetime for generating signed URLs
-        import datetime
-
-        feature_list = []
-        for feature in features:
-            feature_dict = {
-                'name': feature.name,
-                'type': feature.type,
-                'color': feature.color,
-                'line_weight': feature.line_weight,
-                'dash_pattern': feature.dash_pattern,
-                'label': feature.label,
-                'svg': feature.svg,
-                'draw_layer': feature.draw_layer,
-                'z_value': feature.z_value,
-                'form_definition': feature.form_definition
-            }
-
-            # Generate signed URL for the image if image_file_name exists
-            if hasattr(feature, 'image_file_name') and feature.image_file_name:
-                try:
-                    # Construct the object path in your bucket
-                    object_path = f"Feature_PNG/{feature.draw_layer}/{feature.image_file_name}"
-
-                    # Get the blob from your bucket
-                    blob = bucket.blob(object_path)
-
-                    # Check if the blob exists (optional, but helpful for debugging)
-                    if blob.exists():
-                        # Generate a signed URL valid for 24 hours
-                        signed_url = blob.generate_signed_url(
-                            version="v4",
-                            expiration=datetime.timedelta(hours=24),
-                            method="GET",
-                            credentials=credentials
-                        )
-                        feature_dict['image_url'] = signed_url
-                        print(f"Generated signed URL for {object_path}")
-                    else:
-                        print(f"Warning: Image does not exist in bucket: {object_path}")
-                        feature_dict['image_url'] = None
-                except Exception as e:
-                    print(f"Error generating signed URL for {feature.name}: {str(e)}")
-                    feature_dict['image_url'] = None
-            else:
-                feature_dict['image_url'] = None
-
-            feature_list.append(feature_dict)
-        print(f"Sending features to client: {feature_list}")
-        return jsonify({
-            'success': True,
-            'features': feature_list
-        })
+        # Answer revalidation requests without rebuilding the catalog; If-None-Match
+        # uses weak comparison, so W/ tags from re-encoding proxies still match
+        etag, last_modified = feature_catalog_version(project.work_type_id)
+        if request.if_none_match.contains_weak(etag):
+            not_modified = make_response('', 304)
+            not_modified.set_etag(etag)
+            not_modified.last_modified = last_modified
+            not_modified.headers['Cache-Control'] = 'private, no-cache'
+            return not_modified
+
+        # Serve the prebuilt snapshot for this catalog version, building it on a miss
+        snapshot = catalog_snapshots.get(
+            project.work_type_id, etag, last_modified,
+            lambda: build_feature_catalog(project.work_type_id)
+        )
+        return snapshot.to_response()
 
     except Exception as e:
         print(f"Error getting project features: {str(e)}")
@@ -262,6 +214,44 @@ def get_project_feature_types(project_id):
         }), 500
 
 
+def build_feature_catalog(work_type_id):
+    """Serialize the features of a work type for the mobile catalog"""
+    features = Feature.query.join(worktype_features).filter(
+        worktype_features.c.worktype_id == work_type_id
+    ).all()
+
+    feature_list = []
+    for feature in features:
+        feature_dict = {
+            'name': feature.name,
+            'type': feature.type,
+            'color': feature.color,
+            'line_weight': feature.line_weight,
+            'dash_pattern': feature.dash_pattern,
+            'label': feature.label,
+            'svg': feature.svg,
+            'draw_layer': feature.draw_layer,
+            'z_value': feature.z_value,
+            'form_definition': feature.form_definition
+        }
+
+        # Signed URL for the image if image_file_name exists, served from the cache when possible
+        if hasattr(feature, 'image_file_name') and feature.image_file_name:
+            object_path = feature_image_path(feature.draw_layer, feature.image_file_name)
+            try:
+                feature_dict['image_url'] = signed_url_cache.get(bucket, object_path, credentials)
+            except Exception as e:
+                print(f"Error generating signed URL for {feature.name}: {str(e)}")
+                feature_dict['image_url'] = None
+        else:
+            feature_dict['image_url'] = None
+
+        feature_list.append(feature_dict)
+
+    print(f"Built feature catalog snapshot for work type {work_type_id} with {len(feature_list)} features")
+    return feature_list
+
+
 def check_cost_center(cost_center):
     if cost_center == "CORP":
         cost_center = "9013"
@@ -283,28 +273,28 @@ def mobile_projects():
         user = request.current_user
 
         if user.role == 'Admin':
-            projects = Project.query.filter(
+            query = Project.query.filter(
                 Project.is_active == True
             ).options(
                 db.joinedload(Project.work_type)  # Just load the work type info, not features
-            ).order_by(Project.date.desc()).all()
+            )
         else:
             employee_id = user.employee_id
-            employee_id_pattern = f"%{employee_id},%"
-            employee_id_end_pattern = f"%{employee_id}"
 
-            projects = Project.query.filter(
-                and_(
-                    or_(
-                        Project.technicians.like(employee_id_pattern),
-                        Project.technicians.like(employee_id_end_pattern),
-                        Project.technicians == employee_id
-                    ),
-                    Project.is_active == True
-                )
+            query = Project.query.join(
+                ProjectTechnician, ProjectTechnician.project_id == Project.id
+            ).filter(
+                ProjectTechnician.employee_id == str(employee_id),
+                Project.is_active == True
             ).options(
                 db.joinedload(Project.work_type)
-            ).order_by(Project.date.desc()).all()
+            )
+
+        # Read the project location with PostGIS instead of decoding the geometry
+        projects = query.add_columns(
+            func.ST_X(Project.coords).label('longitude'),
+            func.ST_Y(Project.coords).label('latitude')
+        ).order_by(Project.date.desc()).all()
 
         return jsonify({
             'success': True,
@@ -313,12 +303,12 @@ def mobile_projects():
                 'name': project.name,
                 'client_name': project.client_name,
                 'address': project.address,
-                'coords': [to_shape(project.coords).x, to_shape(project.coords).y] if project.coords else None,
+                'coords': [longitude, latitude] if longitude is not None else None,
                 'work_type': {
                     'id': project.work_type.id,
                     'name': project.work_type.name
                 } if project.work_type else None
-            } for project in projects]
+            } for project, longitude, latitude in projects]
         })
 
     except Exception as e:
@@ -363,8 +353,18 @@ def sync_web_features(project_id):
                 # If last_sync is invalid, assume first sync
                 last_sync_dt = None
 
+        # Clients tracking the change log send the last revision they saw instead
+        last_revision = None
+        if data.get('last_revision') is not None:
+            try:
+                last_revision = int(data.get('last_revision'))
+            except (ValueError, TypeError):
+                last_revision = None
+
         # Track successfully created/updated features
         synced_ids = []
+        # Writes skipped because the stored content is identical
+        elided = 0
 
         # Current server time for response
         server_time = datetime.utcnow()
@@ -425,13 +425,17 @@ def sync_web_features(project_id):
                 ).first()
 
                 if existing_feature:
-                    # Feature exists, update it
-                    existing_feature.name = name
-                    existing_feature.draw_layer = draw_layer
-                    existing_feature.type = feature_type
-                    existing_feature.updated_at = server_time
-                    existing_feature.attributes = attributes
                     feature = existing_feature
+                    if feature_content_hash(name, draw_layer, feature_type, attributes) == existing_feature.content_hash:
+                        # Unchanged; leave the row and its updated_at alone
+                        elided += 1
+                    else:
+                        # Feature exists, update it
+                        existing_feature.name = name
+                        existing_feature.draw_layer = draw_layer
+                        existing_feature.type = feature_type
+                        existing_feature.updated_at = server_time
+                        existing_feature.attributes = attributes
                 else:
                     # Create new CollectedFeatures entry
                     feature = CollectedFeatures(
@@ -472,12 +476,18 @@ def sync_web_features(project_id):
                         feature_id=feature.id
                     ).first()
 
-                    if existing_point:
+                    if existing_point and point_content_hash(existing_point.fcode, longitude, latitude,
+                                                             attributes) == existing_point.content_hash:
+                        # Unchanged; leave the row and its updated_at alone
+                        elided += 1
+                    elif existing_point:
                         # Update existing point
                         existing_point.coords = from_shape(point_geom, srid=4326)
                         existing_point.properties = properties
                         existing_point.attributes = attributes
                         existing_point.updated_at = server_time
+                        # The feature changed with its point, even if its own content did not
+                        feature.updated_at = server_time
                     else:
                         # Create new point
                         point = CollectedPoints(
@@ -495,38 +505,45 @@ def sync_web_features(project_id):
                             updated_at=server_time
                         )
                         db.session.add(point)
+                        feature.updated_at = server_time
 
                 # Add client_id to successful list
                 synced_ids.append(client_id)
 
+            # Flush so this request's writes are in the change log before reading the revision
+            db.session.flush()
+            server_revision = current_revision(project_id)
+
             # Query for server features updated since last_sync
             server_features = []
-            if last_sync_dt is not None:
+            if last_revision is not None or last_sync_dt is not None:
                 # Get all features for this project that have been updated since last_sync
                 query = db.session.query(CollectedFeatures) \
                     .filter(CollectedFeatures.project_id == project_id) \
-                    .filter(CollectedFeatures.is_active == True) \
-                    .filter(CollectedFeatures.updated_at > last_sync_dt)
+                    .filter(CollectedFeatures.is_active == True)
+
+                if last_revision is not None:
+                    query = query.filter(
+                        CollectedFeatures.id.in_(changed_feature_ids(project_id, last_revision, server_revision))
+                    )
+                else:
+                    query = query.filter(CollectedFeatures.updated_at > last_sync_dt)
 
                 # Exclude features that were just synced from client
                 if synced_ids:
                     query = query.filter(CollectedFeatures.client_id.notin_(synced_ids))
 
-                # Get all matching features
+                # Get all matching features, with their active points in one extra query
+                query = query.options(selectinload(CollectedFeatures.active_points))
                 for feature in query.all():
-                    # Get all points for this feature
-                    points = CollectedPoints.query.filter_by(
-                        feature_id=feature.id,
-                        is_active=True
-                    ).all()
+                    points = feature.active_points
 
                     # Skip features with no points
                     if not points:
                         continue
 
-                    # Convert first point's coords from WKB to lng/lat array
-                    point_geom = to_shape(points[0].coords)
-                    lng, lat = point_geom.x, point_geom.y
+                    # First point's coordinates, as read by PostGIS
+                    lng, lat = points[0].longitude, points[0].latitude
 
                     # Ensure feature has required attributes
                     feature_attrs = feature.attributes or {}
@@ -539,16 +556,15 @@ def sync_web_features(project_id):
                     # Format all points for this feature
                     feature_points = []
                     for point in points:
-                        point_geom = to_shape(point.coords)
                         feature_points.append({
                             "client_id": point.client_id,
                             "fcode": point.fcode,
-                            "coords": [point_geom.x, point_geom.y],
+                            "coords": [point.longitude, point.latitude],
                             "attributes": point.attributes or {},
                             "created_by": point.created_by,
                             "updated_by": point.updated_by,
-                            "created_at": point.created_at.isoformat() if point.created_at else None,
-                            "updated_at": point.updated_at.isoformat() if point.updated_at else None
+                            "created_at": point.created_at,
+                            "updated_at": point.updated_at
                         })
 
                     # Format feature data for response
@@ -561,8 +577,8 @@ def sync_web_features(project_id):
                         "coords": [lng, lat],  # Use first point's coordinates
                         "created_by": feature.created_by,
                         "updated_by": feature.updated_by,
-                        "created_at": feature.created_at.isoformat() if feature.created_at else None,
-                        "updated_at": feature.updated_at.isoformat() if feature.updated_at else None,
+                        "created_at": feature.created_at,
+                        "updated_at": feature.updated_at,
                         "attributes": feature_attrs,
                         "points": feature_points
                     }
@@ -575,8 +591,10 @@ def sync_web_features(project_id):
             return jsonify({
                 "success": True,
                 "syncedIds": synced_ids,
+                "elided": elided,
                 "serverFeatures": server_features,
-                "serverTime": server_time.isoformat()
+                "serverTime": server_time,
+                "serverRevision": server_revision
             }), 200
 
         except Exception as e:
@@ -596,4 +614,11 @@ def sync_web_features(project_id):
         return jsonify({
             "success": False,
             "message": f"Server error: {str(e)}"
-        }), 500
\ No newline at end of file
+        }), 500
+
+@projects_bp.cli.command('backfill-technicians')
+def backfill_technicians_command():
+    """Create the project_technician table if needed and fill it from Project.technicians"""
+    ProjectTechnician.__table__.create(db.engine, checkfirst=True)
+    count = ProjectTechnician.backfill_from_projects()
+    print(f"Backfilled technician membership for {count} projects")
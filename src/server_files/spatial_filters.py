@@ -0,0 +1,112 @@
+# spatial_filters.py
+import math
+
+from geoalchemy2 import Geography
+from sqlalchemy import and_, cast, func
+
+# Largest accepted search radius, in meters
+MAX_RADIUS_METERS = 100_000
+# Shortest degree of latitude (at the equator) and longest degree of longitude (on the
+# equator), in meters; they size the index prefilter of radius searches so that it never
+# cuts into the search circle
+METERS_PER_DEGREE_LATITUDE_MIN = 110_574
+METERS_PER_DEGREE_LONGITUDE_MAX = 111_320
+# Extra room around the prefilter box for the spheroid's deviation from these figures
+PREFILTER_MARGIN = 1.01
+
+
+class SpatialFilter:
+    """
+    Viewport (bbox) and radius-around-point filter parsed from query parameters.
+
+    Query parameters:
+        bbox: minLon,minLat,maxLon,maxLat in WGS84 degrees
+        near: lon,lat of the search center
+        radius: search radius in meters, required with near
+
+    When both are given, geometries must match both.
+    """
+
+    def __init__(self, bbox=None, near=None, radius=None):
+        self.bbox = bbox
+        self.near = near
+        self.radius = radius
+
+    @classmethod
+    def from_args(cls, args):
+        """
+        Parse the filter from request arguments.
+
+        Returns:
+            SpatialFilter, or None when no spatial parameter was given
+
+        Raises:
+            ValueError: If a parameter is malformed or out of range
+        """
+        bbox = args.get('bbox')
+        near = args.get('near')
+        radius = args.get('radius')
+        if not bbox and not near and not radius:
+            return None
+
+        if bbox:
+            min_lon, min_lat, max_lon, max_lat = _parse_numbers(bbox, 4, 'bbox')
+            if min_lon > max_lon or min_lat > max_lat:
+                raise ValueError("bbox must be minLon,minLat,maxLon,maxLat")
+            _check_position(min_lon, min_lat, 'bbox')
+            _check_position(max_lon, max_lat, 'bbox')
+            bbox = (min_lon, min_lat, max_lon, max_lat)
+
+        if near or radius:
+            if not (near and radius):
+                raise ValueError("near and radius must be given together")
+            near = _parse_numbers(near, 2, 'near')
+            _check_position(near[0], near[1], 'near')
+            radius = _parse_numbers(radius, 1, 'radius')[0]
+            if not 0 < radius <= MAX_RADIUS_METERS:
+                raise ValueError(f"radius must be between 0 and {MAX_RADIUS_METERS} meters")
+
+        return cls(bbox=bbox or None, near=near or None, radius=radius or None)
+
+    def condition(self, geometry):
+        """
+        Build the SQL condition for a geometry column or expression in SRID 4326.
+
+        The bbox test and the envelope prefilter of the radius test are plain geometry
+        comparisons, so a GiST index on an indexed column is used for both.
+        """
+        conditions = []
+        if self.bbox:
+            conditions.append(func.ST_Intersects(geometry, func.ST_MakeEnvelope(*self.bbox, 4326)))
+        if self.near:
+            lon, lat = self.near
+            center = func.ST_SetSRID(func.ST_MakePoint(lon, lat), 4326)
+            lat_degrees = self.radius / METERS_PER_DEGREE_LATITUDE_MIN * PREFILTER_MARGIN
+            # The circle is widest in degrees of longitude at its poleward edge
+            cos_edge = math.cos(math.radians(min(abs(lat) + lat_degrees, 90)))
+            if cos_edge < 0.01:
+                # The circle reaches a pole, so the box spans every longitude
+                lon_degrees = 360
+            else:
+                lon_degrees = self.radius / (METERS_PER_DEGREE_LONGITUDE_MAX * cos_edge) * PREFILTER_MARGIN
+            conditions.append(func.ST_Intersects(geometry, func.ST_Expand(center, lon_degrees, lat_degrees)))
+            conditions.append(func.ST_DWithin(cast(geometry, Geography), cast(center, Geography), self.radius))
+        return and_(*conditions)
+
+
+def _parse_numbers(value, count, name):
+    parts = str(value).split(',')
+    if len(parts) != count:
+        raise ValueError(f"{name} must have {count} comma-separated values")
+    try:
+        numbers = [float(part) for part in parts]
+    except ValueError:
+        raise ValueError(f"{name} must contain only numbers")
+    if not all(math.isfinite(number) for number in numbers):
+        raise ValueError(f"{name} must contain only finite numbers")
+    return numbers
+
+
+def _check_position(lon, lat, name):
+    if not -180 <= lon <= 180 or not -90 <= lat <= 90:
+        raise ValueError(f"{name} is outside WGS84 bounds")
@@ -0,0 +1,87 @@
+# sync_batch_model.py
+import json
+from datetime import datetime, timedelta
+
+import pytz
+from flask import current_app
+from sqlalchemy.dialects.postgresql import insert
+
+from website import db
+from website.models.model_helpers import UTCDateTime
+
+# Longest accepted Idempotency-Key header
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+# How long stored batch outcomes are kept for replay
+IDEMPOTENCY_RETENTION = timedelta(days=7)
+
+
+class SyncBatch(db.Model):
+    """
+    Outcome of a sync request sent with an Idempotency-Key header.
+
+    The row is claimed in the same transaction that applies the batch, so a retry
+    either waits for the first attempt to commit and then replays its response, or
+    finds no row because the first attempt rolled back and applies the batch itself.
+    """
+    __table_args__ = (
+        db.UniqueConstraint('project_id', 'idempotency_key', name='uq_sync_batch_project_key'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    project_id = db.Column(db.Integer, db.ForeignKey('project.id', ondelete='CASCADE'), nullable=False)
+    idempotency_key = db.Column(db.String(IDEMPOTENCY_KEY_MAX_LENGTH), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    request_hash = db.Column(db.String(64), nullable=False)  # SHA-256 of the request body
+    status_code = db.Column(db.Integer)
+    response = db.Column(db.JSON)
+    created_at = db.Column(UTCDateTime, default=lambda: datetime.now(pytz.UTC), nullable=False, index=True)
+
+    def __repr__(self):
+        return f'<SyncBatch {self.idempotency_key} for Project {self.project_id}>'
+
+    @classmethod
+    def find(cls, project_id, idempotency_key):
+        return db.session.query(cls).filter_by(project_id=project_id, idempotency_key=idempotency_key).first()
+
+    @classmethod
+    def claim(cls, project_id, idempotency_key, user_id, request_hash):
+        """
+        Insert the batch row unless one exists for the key.
+
+        A concurrent attempt with the same key blocks here until the first one commits
+        or rolls back.
+
+        Returns:
+            The new SyncBatch, or None if the key was already used
+        """
+        stmt = insert(cls).values(
+            project_id=project_id,
+            idempotency_key=idempotency_key,
+            user_id=user_id,
+            request_hash=request_hash,
+            created_at=datetime.now(pytz.UTC)
+        ).on_conflict_do_nothing(
+            index_elements=[cls.project_id, cls.idempotency_key]
+        ).returning(cls.id)
+        batch_id = db.session.execute(stmt).scalar()
+        return db.session.get(cls, batch_id) if batch_id is not None else None
+
+    def store_response(self, payload, status_code):
+        """Keep the response for replay, encoded as it was sent"""
+        self.response = json.loads(current_app.json.dumps(payload))
+        self.status_code = status_code
+
+    @classmethod
+    def purge_expired(cls, retention=IDEMPOTENCY_RETENTION):
+        """
+        Delete batch outcomes older than the retention period.
+
+        Intended for a periodic maintenance task.
+
+        Returns:
+            Number of rows deleted
+        """
+        cutoff = datetime.now(pytz.UTC) - retention
+        count = db.session.query(cls).filter(cls.created_at < cutoff).delete(synchronize_session=False)
+        db.session.commit()
+        return count
@@ -0,0 +1,142 @@
+# sync_codec.py
+import struct
+from datetime import datetime, timezone
+
+from flask import request, jsonify, Response
+
+from website.blueprints.sync_engine import parse_iso_datetime
+
+try:
+    import msgpack
+except ImportError:  # binary sync is optional; JSON stays the default
+    msgpack = None
+
+MSGPACK_MIMETYPE = 'application/msgpack'
+MSGPACK_MIMETYPES = (MSGPACK_MIMETYPE, 'application/x-msgpack', 'application/vnd.msgpack')
+
+# Fields exchanged as integer microseconds since the epoch (UTC)
+_TIMESTAMP = 'timestamp'
+# Fields whose [longitude, latitude] values are exchanged as packed little-endian float64 pairs
+_COORDINATES = 'coordinates'
+
+# Where those fields sit in sync requests and responses; everything else, including
+# user attributes that happen to share a field name, is passed through unchanged.
+# A nested dict applies to an object, or to each object of a list.
+_POINT_WIRE_FIELDS = {'coords': _COORDINATES, 'created_at': _TIMESTAMP, 'updated_at': _TIMESTAMP}
+_FEATURE_WIRE_FIELDS = {
+    'lastModified': _TIMESTAMP,
+    'data': {'created_at': _TIMESTAMP, 'updated_at': _TIMESTAMP, 'points': _POINT_WIRE_FIELDS}
+}
+SYNC_WIRE_FIELDS = {
+    'lastSyncTimestamp': _TIMESTAMP,
+    'serverTimestamp': _TIMESTAMP,
+    'features': _FEATURE_WIRE_FIELDS,
+    'changes': _FEATURE_WIRE_FIELDS
+}
+
+_COORDINATE_PAIR = struct.Struct('<2d')
+
+
+def is_msgpack_request():
+    """Whether the request body is MessagePack"""
+    return request.mimetype in MSGPACK_MIMETYPES
+
+
+def wants_msgpack():
+    """Whether the client prefers a MessagePack response over JSON"""
+    if msgpack is None:
+        return False
+    best = request.accept_mimetypes.best_match(['application/json'] + list(MSGPACK_MIMETYPES))
+    return best in MSGPACK_MIMETYPES
+
+
+def decode_sync_request():
+    """
+    Decode a MessagePack sync request into the same structure as the JSON format.
+
+    Raises:
+        ValueError: If MessagePack support is not installed or the body is invalid
+    """
+    if msgpack is None:
+        raise ValueError("MessagePack is not supported by this server")
+    try:
+        data = msgpack.unpackb(request.get_data(), raw=False, strict_map_key=False)
+    except (msgpack.ExtraData, msgpack.FormatError, msgpack.StackError, ValueError) as e:
+        raise ValueError(f"Invalid MessagePack body: {str(e)}") from e
+    return _from_wire(data)
+
+
+def sync_response(payload, status=200):
+    """Encode a sync response payload as MessagePack or JSON, following the Accept header"""
+    if wants_msgpack():
+        body = msgpack.packb(_to_wire(payload), use_bin_type=True)
+        return Response(body, status=status, mimetype=MSGPACK_MIMETYPE)
+    return jsonify(payload), status
+
+
+def _convert_fields(value, fields, convert):
+    """Apply convert(value, kind) to the fields named in a SYNC_WIRE_FIELDS-style mapping"""
+    if isinstance(value, list):
+        return [_convert_fields(item, fields, convert) for item in value]
+    if not isinstance(value, dict):
+        return value
+    converted = {}
+    for key, item in value.items():
+        kind = fields.get(key)
+        if kind is None:
+            converted[key] = item
+        elif isinstance(kind, dict):
+            converted[key] = _convert_fields(item, kind, convert)
+        else:
+            converted[key] = convert(item, kind)
+    return converted
+
+
+def _to_wire(value):
+    return _convert_fields(value, SYNC_WIRE_FIELDS, _field_to_wire)
+
+
+def _from_wire(value):
+    return _convert_fields(value, SYNC_WIRE_FIELDS, _field_from_wire)
+
+
+def _field_to_wire(value, kind):
+    if kind == _COORDINATES and _is_coordinate_pair(value):
+        return _COORDINATE_PAIR.pack(float(value[0]), float(value[1]))
+    if kind == _TIMESTAMP:
+        return _to_epoch_micros(value)
+    return value
+
+
+def _field_from_wire(value, kind):
+    if kind == _COORDINATES and isinstance(value, bytes) and len(value) == _COORDINATE_PAIR.size:
+        return list(_COORDINATE_PAIR.unpack(value))
+    if kind == _TIMESTAMP and isinstance(value, int) and not isinstance(value, bool):
+        return _from_epoch_micros(value)
+    return value
+
+
+def _is_coordinate_pair(value):
+    return (isinstance(value, (list, tuple)) and len(value) == 2
+            and all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in value))
+
+
+def _to_epoch_micros(value):
+    """
+    Convert a datetime or ISO string to integer microseconds since the epoch, naive values being UTC.
+
+    Anything else, including a string that does not parse, is returned unchanged.
+    """
+    moment = parse_iso_datetime(value) if isinstance(value, str) else value
+    if not isinstance(moment, datetime):
+        return value
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    delta = moment - datetime(1970, 1, 1, tzinfo=timezone.utc)
+    return (delta.days * 86400 + delta.seconds) * 1_000_000 + delta.microseconds
+
+
+def _from_epoch_micros(value):
+    """Convert integer microseconds since the epoch to an ISO-8601 UTC string"""
+    seconds, micros = divmod(value, 1_000_000)
+    return datetime.fromtimestamp(seconds, tz=timezone.utc).replace(microsecond=micros).isoformat()
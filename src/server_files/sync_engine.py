@@ -0,0 +1,499 @@
+# sync_engine.py
+
+from datetime import timezone
+
+import numpy as np
+import shapely
+from dateutil import parser
+from geoalchemy2.elements import WKBElement
+from sqlalchemy import tuple_, update
+from sqlalchemy.dialects.postgresql import insert
+from website import db
+from website.models.collected.collected_change_log_model import record_changes
+from website.models.collected.collected_features_model import CollectedFeatures
+from website.models.collected.collected_points_model import CollectedPoints
+from website.models.collected.content_hash import feature_content_hash, point_content_hash
+
+# Maximum number of rows sent to the database in a single bulk statement
+SYNC_BATCH_SIZE = 500
+
+
+def apply_client_features(project_id, client_features, current_user_id, client_timezone, server_time):
+    """
+    Apply a batch of client features and their points with set-based statements.
+
+    Existing features and points are prefetched with one query each, deletions are
+    applied with a single UPDATE and inserts/updates are issued as
+    INSERT ... ON CONFLICT statements, so the number of round-trips does not grow
+    with the number of features or points in the batch. Attributes may be sent whole
+    or as a JSON Merge Patch (attributesPatch) of the stored ones; the patched keys
+    are recorded with the change so that revision deltas can ship only those keys.
+    Features and points whose content hash matches the stored row are not written at
+    all, so re-sent data does not touch updated_at; a feature is still stamped with
+    server_time when any of its points is written. Every written row is recorded in
+    the project's change log.
+
+    Args:
+        project_id: The project ID
+        client_features: List of features in the mobile sync format
+        current_user_id: The current user ID
+        client_timezone: Timezone stored in attributes that do not carry one
+        server_time: Datetime used for updated_at on every written row
+
+    Returns:
+        Tuple of (processed client IDs, failed client IDs, number of elided writes)
+    """
+    processed_feature_ids = []
+    failed_feature_ids = []
+    elided = 0
+
+    client_ids = [f.get('clientId') for f in client_features if f.get('clientId')]
+    existing_features = _prefetch_features(project_id, client_ids)
+    # Stored attributes are only loaded for features sent as a merge patch
+    stored_attributes = _prefetch_feature_attributes(project_id, [
+        f.get('clientId') for f in client_features
+        if f.get('clientId') in existing_features and _attributes_patch(f.get('data')) is not None
+    ])
+    feature_changed_keys = {}
+
+    deleted_ids = []
+    feature_rows = {}
+    feature_points = {}
+
+    for feature_data in client_features:
+        client_id = feature_data.get('clientId')
+        if not client_id:
+            continue
+
+        existing_feature = existing_features.get(client_id)
+
+        # If deleted, mark as inactive instead of actual deletion
+        if feature_data.get('deleted', False):
+            if existing_feature:
+                deleted_ids.append(client_id)
+                processed_feature_ids.append(client_id)
+            continue
+
+        # Get full feature data if not deleted
+        feature_full_data = feature_data.get('data', {})
+        if not feature_full_data:
+            failed_feature_ids.append(client_id)
+            continue
+
+        # Attributes arrive whole or as a merge patch of the stored attributes
+        attributes_patch = _attributes_patch(feature_full_data)
+        if attributes_patch is not None:
+            feature_attributes = apply_merge_patch(stored_attributes.get(client_id) or {}, attributes_patch)
+            changed_keys = set(attributes_patch)
+        else:
+            feature_attributes = feature_full_data.get('attributes', {}) or {}
+            changed_keys = None
+
+        # Store timezone in attributes if not already present
+        if 'timezone' not in feature_attributes:
+            feature_attributes['timezone'] = client_timezone
+            if changed_keys is not None:
+                changed_keys.add('timezone')
+        feature_full_data['attributes'] = feature_attributes
+        if existing_feature and changed_keys is not None:
+            feature_changed_keys[client_id] = sorted(changed_keys)
+
+        if existing_feature:
+            # Only update if client version is newer
+            client_modified = parse_iso_datetime(feature_data.get('lastModified'))
+            if client_modified and client_modified > existing_feature.updated_at:
+                draw_layer = feature_full_data.get('draw_layer', existing_feature.draw_layer)
+                feature_type = feature_full_data.get('type', existing_feature.type)
+                name = feature_full_data.get('name', existing_feature.name)
+                content_hash = feature_content_hash(name, draw_layer, feature_type, feature_attributes)
+
+                # Same content as stored: nothing to write
+                if content_hash == existing_feature.content_hash:
+                    elided += 1
+                else:
+                    feature_rows[client_id] = {
+                        'client_id': client_id,
+                        'draw_layer': draw_layer,
+                        'type': feature_type,
+                        'name': name,
+                        'project_id': project_id,
+                        'attributes': feature_attributes,
+                        'content_hash': content_hash,
+                        'created_by': current_user_id,
+                        'created_at': server_time,
+                        'updated_at': server_time,
+                        'updated_by': current_user_id,
+                        'is_active': True
+                    }
+        else:
+            feature_rows[client_id] = {
+                'client_id': client_id,
+                'draw_layer': feature_full_data.get('draw_layer'),
+                'type': feature_full_data.get('type'),
+                'name': feature_full_data.get('name'),
+                'project_id': project_id,
+                'attributes': feature_attributes,
+                'content_hash': feature_content_hash(feature_full_data.get('name'), feature_full_data.get('draw_layer'),
+                                                     feature_full_data.get('type'), feature_attributes),
+                'created_by': current_user_id,
+                'created_at': parse_iso_datetime(feature_full_data.get('created_at')) or server_time,
+                'updated_at': server_time,
+                'updated_by': current_user_id,
+                'is_active': True
+            }
+
+        feature_points[client_id] = feature_full_data.get('points', [])
+        processed_feature_ids.append(client_id)
+
+    # Change log entries for every row written by this batch
+    changes = []
+
+    if deleted_ids:
+        deleted_rows = db.session.execute(
+            update(CollectedFeatures)
+            .where(CollectedFeatures.project_id == project_id)
+            .where(CollectedFeatures.client_id.in_(deleted_ids))
+            .values(is_active=False, updated_at=server_time, updated_by=current_user_id)
+            .returning(CollectedFeatures.id)
+            .execution_options(synchronize_session=False)
+        )
+        changes.extend(('feature', feature_id, feature_id) for feature_id, in deleted_rows)
+
+    # Resolve database IDs for every feature whose points we are about to write
+    feature_ids = {client_id: feature.id for client_id, feature in existing_features.items()}
+    upserted_feature_ids = _upsert_features(list(feature_rows.values()))
+    feature_ids.update(upserted_feature_ids)
+    changes.extend(('feature', feature_id, feature_id, feature_changed_keys.get(client_id))
+                   for client_id, feature_id in upserted_feature_ids.items())
+
+    point_rows, elided_points, point_changed_keys = _build_point_rows(
+        project_id, feature_points, feature_ids, current_user_id, client_timezone, server_time
+    )
+    elided += elided_points
+    written_points = _upsert_points(point_rows)
+    changes.extend(('point', point_id, feature_id, point_changed_keys.get((feature_id, client_id)))
+                   for point_id, feature_id, client_id in written_points)
+
+    # A feature whose own write was elided still changed when one of its points did;
+    # bump its updated_at so timestamp-based change queries pick the points up
+    _touch_features(
+        {feature_id for _, feature_id, _ in written_points} - set(upserted_feature_ids.values()),
+        current_user_id, server_time
+    )
+
+    record_changes(project_id, changes)
+
+    return processed_feature_ids, failed_feature_ids, elided
+
+
+def _prefetch_features(project_id, client_ids):
+    """Load the columns needed for sync decisions for all incoming features in one query"""
+    if not client_ids:
+        return {}
+
+    rows = db.session.query(
+        CollectedFeatures.id,
+        CollectedFeatures.client_id,
+        CollectedFeatures.name,
+        CollectedFeatures.draw_layer,
+        CollectedFeatures.type,
+        CollectedFeatures.content_hash,
+        CollectedFeatures.updated_at
+    ).filter(
+        CollectedFeatures.project_id == project_id,
+        CollectedFeatures.client_id.in_(set(client_ids))
+    ).all()
+
+    return {row.client_id: row for row in rows}
+
+
+def _prefetch_feature_attributes(project_id, client_ids):
+    """Load stored attributes keyed by client_id, for features sent as a merge patch"""
+    if not client_ids:
+        return {}
+
+    rows = db.session.query(CollectedFeatures.client_id, CollectedFeatures.attributes).filter(
+        CollectedFeatures.project_id == project_id,
+        CollectedFeatures.client_id.in_(set(client_ids))
+    ).all()
+
+    return {row.client_id: row.attributes for row in rows}
+
+
+def _prefetch_point_attributes(keys):
+    """Load stored attributes keyed by (feature_id, client_id), for points sent as a merge patch"""
+    if not keys:
+        return {}
+
+    rows = db.session.query(CollectedPoints.feature_id, CollectedPoints.client_id, CollectedPoints.attributes).filter(
+        tuple_(CollectedPoints.feature_id, CollectedPoints.client_id).in_(list(set(keys)))
+    ).all()
+
+    return {(row.feature_id, row.client_id): row.attributes for row in rows}
+
+
+def _prefetch_points(feature_ids, point_client_ids):
+    """Load existing point fcodes and content hashes keyed by (feature_id, client_id) in one query"""
+    if not feature_ids or not point_client_ids:
+        return {}
+
+    rows = db.session.query(
+        CollectedPoints.feature_id,
+        CollectedPoints.client_id,
+        CollectedPoints.fcode,
+        CollectedPoints.content_hash
+    ).filter(
+        CollectedPoints.feature_id.in_(set(feature_ids)),
+        CollectedPoints.client_id.in_(set(point_client_ids))
+    ).all()
+
+    return {(row.feature_id, row.client_id): row for row in rows}
+
+
+def _build_point_rows(project_id, feature_points, feature_ids, current_user_id, client_timezone, server_time):
+    """
+    Flatten the points of every synced feature into rows ready for a bulk upsert.
+
+    Returns:
+        Tuple of (rows to write, number of points skipped because they are unchanged,
+        patched attribute keys by (feature_id, client_id))
+    """
+    point_client_ids = [p.get('client_id') for points in feature_points.values() for p in points
+                        if p.get('client_id')]
+    existing_points = _prefetch_points(
+        [feature_ids[client_id] for client_id in feature_points if client_id in feature_ids],
+        point_client_ids
+    )
+    # Stored attributes are only loaded for points sent as a merge patch
+    stored_attributes = _prefetch_point_attributes([
+        (feature_ids[feature_client_id], p.get('client_id'))
+        for feature_client_id, points in feature_points.items() if feature_client_id in feature_ids
+        for p in points
+        if (feature_ids[feature_client_id], p.get('client_id')) in existing_points and _attributes_patch(p) is not None
+    ])
+
+    point_rows = {}
+    point_changed_keys = {}
+    for feature_client_id, points_data in feature_points.items():
+        feature_id = feature_ids.get(feature_client_id)
+        if feature_id is None:
+            continue
+
+        for point_data in points_data:
+            point_client_id = point_data.get('client_id')
+            if not point_client_id:
+                continue
+
+            # Attributes arrive whole or as a merge patch of the stored attributes
+            attributes_patch = _attributes_patch(point_data)
+            if attributes_patch is not None:
+                point_attributes = apply_merge_patch(stored_attributes.get((feature_id, point_client_id)) or {},
+                                                     attributes_patch)
+                changed_keys = set(attributes_patch)
+            else:
+                point_attributes = point_data.get('attributes', {}) or {}
+                changed_keys = None
+
+            # Store timezone in point attributes if not already present
+            if 'timezone' not in point_attributes:
+                point_attributes['timezone'] = client_timezone
+                if changed_keys is not None:
+                    changed_keys.add('timezone')
+
+            existing_point = existing_points.get((feature_id, point_client_id))
+            default_fcode = existing_point.fcode if existing_point else ''
+            if existing_point and changed_keys is not None:
+                point_changed_keys[(feature_id, point_client_id)] = sorted(changed_keys)
+
+            point_rows[(feature_id, point_client_id)] = {
+                'client_id': point_client_id,
+                'fcode': point_data.get('fcode', default_fcode),
+                'coords': point_data.get('coords'),
+                'attributes': point_attributes,
+                'project_id': project_id,
+                'feature_id': feature_id,
+                'created_by': current_user_id,
+                'created_at': parse_iso_datetime(point_data.get('created_at')) or server_time,
+                'updated_at': server_time,
+                'updated_by': current_user_id,
+                'is_active': True
+            }
+
+    rows = list(point_rows.values())
+    # Validate and encode the whole batch's coordinates at once
+    coords = validate_coordinates([row['coords'] for row in rows])
+    changed_rows = []
+    for row, geometry, (longitude, latitude) in zip(rows, point_geometries(coords), coords.tolist()):
+        row['coords'] = geometry
+        row['content_hash'] = point_content_hash(row['fcode'], longitude, latitude, row['attributes'])
+
+        # Same content as stored: nothing to write
+        existing_point = existing_points.get((row['feature_id'], row['client_id']))
+        if existing_point and existing_point.content_hash == row['content_hash']:
+            continue
+        changed_rows.append(row)
+
+    return changed_rows, len(rows) - len(changed_rows), point_changed_keys
+
+
+def apply_merge_patch(target, patch):
+    """
+    Apply a JSON Merge Patch (RFC 7396) to a value.
+
+    Objects are merged recursively, null removes a key and any other value replaces
+    the target. The target is not modified.
+    """
+    if not isinstance(patch, dict):
+        return patch
+    result = dict(target) if isinstance(target, dict) else {}
+    for key, value in patch.items():
+        if value is None:
+            result.pop(key, None)
+        else:
+            result[key] = apply_merge_patch(result.get(key), value)
+    return result
+
+
+def _attributes_patch(data):
+    """The attributesPatch object of a feature or point payload, None if attributes were sent whole"""
+    if not isinstance(data, dict):
+        return None
+    patch = data.get('attributesPatch')
+    return patch if isinstance(patch, dict) else None
+
+
+def validate_coordinates(coords_list):
+    """
+    Convert a batch of client coordinates to a float64 array of shape (n, 2).
+
+    Coordinates are checked as one array: missing or malformed pairs, NaN or infinite
+    values and positions outside WGS84 bounds all fall back to [0, 0], as single
+    points always have.
+
+    Args:
+        coords_list: List of [longitude, latitude] values as sent by the client
+    """
+    if not coords_list:
+        return np.zeros((0, 2), dtype=np.float64)
+
+    pairs = [coords[:2] if isinstance(coords, list) and len(coords) >= 2 else (0, 0)
+             for coords in coords_list]
+    try:
+        coords = np.array(pairs, dtype=np.float64)
+    except (TypeError, ValueError):
+        coords = np.array([_coordinate_pair(pair) for pair in pairs], dtype=np.float64)
+
+    invalid = (~np.isfinite(coords).all(axis=1)
+               | (np.abs(coords[:, 0]) > 180)
+               | (np.abs(coords[:, 1]) > 90))
+    coords[invalid] = 0.0
+    return coords
+
+
+def point_geometries(coords):
+    """
+    Encode validated coordinates as WKB point geometries with one shapely call.
+
+    Args:
+        coords: Array from validate_coordinates()
+
+    Returns:
+        List of WKBElement geometries in SRID 4326, in the same order
+    """
+    if not len(coords):
+        return []
+    wkbs = shapely.to_wkb(shapely.points(coords))
+    return [WKBElement(wkb, srid=4326) for wkb in wkbs]
+
+
+def _coordinate_pair(pair):
+    """Convert one pair to floats, or NaN when a value is not numeric"""
+    converted = []
+    for value in pair:
+        try:
+            converted.append(float(value))
+        except (TypeError, ValueError):
+            converted.append(float('nan'))
+    return converted
+
+
+def _upsert_features(rows):
+    """Insert or update features in bulk and return a client_id -> id mapping"""
+    feature_ids = {}
+    for chunk in _chunks(rows):
+        stmt = insert(CollectedFeatures).values(chunk)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[CollectedFeatures.project_id, CollectedFeatures.client_id],
+            set_={
+                'name': stmt.excluded.name,
+                'draw_layer': stmt.excluded.draw_layer,
+                'type': stmt.excluded.type,
+                'attributes': stmt.excluded.attributes,
+                'content_hash': stmt.excluded.content_hash,
+                'updated_at': stmt.excluded.updated_at,
+                'updated_by': stmt.excluded.updated_by
+            }
+        ).returning(CollectedFeatures.id, CollectedFeatures.client_id)
+
+        for feature_id, client_id in db.session.execute(stmt):
+            feature_ids[client_id] = feature_id
+
+    return feature_ids
+
+
+def _upsert_points(rows):
+    """Insert or update points in bulk and return (id, feature_id, client_id) for every written point"""
+    written = []
+    for chunk in _chunks(rows):
+        stmt = insert(CollectedPoints).values(chunk)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[CollectedPoints.feature_id, CollectedPoints.client_id],
+            set_={
+                'coords': stmt.excluded.coords,
+                'fcode': stmt.excluded.fcode,
+                'attributes': stmt.excluded.attributes,
+                'content_hash': stmt.excluded.content_hash,
+                'updated_at': stmt.excluded.updated_at,
+                'updated_by': stmt.excluded.updated_by
+            }
+        ).returning(CollectedPoints.id, CollectedPoints.feature_id, CollectedPoints.client_id)
+
+        written.extend(db.session.execute(stmt))
+
+    return written
+
+
+def _touch_features(feature_ids, current_user_id, server_time):
+    """Set updated_at on features whose points were written without the feature itself"""
+    feature_ids = sorted(feature_ids)
+    for chunk in _chunks(feature_ids):
+        db.session.execute(
+            update(CollectedFeatures)
+            .where(CollectedFeatures.id.in_(chunk))
+            .values(updated_at=server_time, updated_by=current_user_id)
+            .execution_options(synchronize_session=False)
+        )
+
+
+def _chunks(rows):
+    for start in range(0, len(rows), SYNC_BATCH_SIZE):
+        yield rows[start:start + SYNC_BATCH_SIZE]
+
+
+def parse_iso_datetime(datetime_str):
+    """Convert ISO format datetime string to a Python datetime in UTC"""
+    if not datetime_str or not isinstance(datetime_str, str):
+        return None
+
+    try:
+        dt = parser.isoparse(datetime_str)
+        # Convert to UTC if timezone info exists
+        if dt.tzinfo is not None:
+            dt = dt.astimezone(timezone.utc)
+        else:
+            # If no timezone info, assume it's already UTC
+            # but we don't add timezone info to avoid db comparison issues
+            pass
+        return dt
+    except (ValueError, TypeError):
+        return None
@@ -0,0 +1,62 @@
+# sync_job_model.py
+from datetime import datetime
+
+import pytz
+
+from website import db
+from website.models.model_helpers import UTCDateTime
+
+SYNC_JOB_PENDING = 'pending'
+SYNC_JOB_RUNNING = 'running'
+SYNC_JOB_COMPLETED = 'completed'
+SYNC_JOB_FAILED = 'failed'
+
+
+class SyncJob(db.Model):
+    """
+    A sync request accepted for background processing.
+
+    The request body is stored as received; the worker applies it exactly as the
+    synchronous endpoint would and stores the sync response in result. Jobs of one
+    project are applied in id order.
+    """
+    __table_args__ = (
+        # Oldest unfinished job of a project, read by the worker before each batch
+        db.Index('ix_sync_job_project_unfinished', 'project_id', 'id',
+                 postgresql_where=db.text("status IN ('pending', 'running')")),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    project_id = db.Column(db.Integer, db.ForeignKey('project.id', ondelete='CASCADE'), nullable=False, index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    status = db.Column(db.Enum(SYNC_JOB_PENDING, SYNC_JOB_RUNNING, SYNC_JOB_COMPLETED, SYNC_JOB_FAILED,
+                               name='sync_job_status'), nullable=False, default=SYNC_JOB_PENDING)
+    request_data = db.Column(db.JSON, nullable=False)  # sync request body as sent by the client
+    result = db.Column(db.JSON)  # sync response once completed
+    error = db.Column(db.Text)  # failure message once failed
+
+    created_at = db.Column(UTCDateTime, default=lambda: datetime.now(pytz.UTC), nullable=False)
+    started_at = db.Column(UTCDateTime)
+    finished_at = db.Column(UTCDateTime)
+
+    def __repr__(self):
+        return f'<SyncJob {self.id} for Project {self.project_id}: {self.status}>'
+
+    @property
+    def is_finished(self):
+        return self.status in (SYNC_JOB_COMPLETED, SYNC_JOB_FAILED)
+
+    def to_dict(self):
+        """Format the job for the status endpoint"""
+        data = {
+            "jobId": self.id,
+            "status": self.status,
+            "createdAt": self.created_at,
+            "startedAt": self.started_at,
+            "finishedAt": self.finished_at
+        }
+        if self.status == SYNC_JOB_COMPLETED:
+            data["result"] = self.result
+        elif self.status == SYNC_JOB_FAILED:
+            data["error"] = self.error
+        return data
@@ -0,0 +1,241 @@
+# sync_jobs.py
+import json
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+
+import pytz
+from flask import current_app, request
+from sqlalchemy import func, text
+
+from website import db
+from website.models.collected.sync_job_model import (
+    SyncJob, SYNC_JOB_PENDING, SYNC_JOB_RUNNING, SYNC_JOB_COMPLETED, SYNC_JOB_FAILED
+)
+
+# Requests carrying more points than this are applied in the background
+SYNC_JOB_POINT_THRESHOLD = int(os.environ.get('SYNC_JOB_POINT_THRESHOLD', 2000))
+# Number of worker processes applying background jobs, per web worker process
+SYNC_JOB_WORKERS = int(os.environ.get('SYNC_JOB_WORKERS', 2))
+# Longest wait accepted by the long-poll status endpoint, in seconds
+SYNC_JOB_MAX_WAIT = 30
+SYNC_JOB_POLL_INTERVAL = 0.5
+# Seconds a streamed sync is asked to wait while the project still has unfinished jobs
+SYNC_JOB_RETRY_AFTER = 5
+# Namespace of the advisory locks that serialize jobs per project
+SYNC_JOB_LOCK_NAMESPACE = 7401
+# Namespace of the transaction locks that order synchronous syncs against job creation
+SYNC_ORDER_LOCK_NAMESPACE = 7402
+
+
+def count_sync_points(data):
+    """Count the points carried by a sync request body"""
+    features = data.get('features') or []
+    if not isinstance(features, list):
+        return 0
+    return sum(
+        len((feature.get('data') or {}).get('points') or [])
+        for feature in features
+        if isinstance(feature, dict) and isinstance(feature.get('data') or {}, dict)
+    )
+
+
+def wants_sync_job(data):
+    """
+    Whether a sync request should be applied in the background.
+
+    Oversized requests always are; clients may also ask for it with
+    "Prefer: respond-async" (RFC 7240).
+    """
+    if 'respond-async' in request.headers.get('Prefer', '').lower():
+        return True
+    return count_sync_points(data) > SYNC_JOB_POINT_THRESHOLD
+
+
+def lock_sync_order(project_id):
+    """
+    Serialize this transaction with other syncs of the project until it ends.
+
+    Taken before deciding whether to apply a request or queue it, so that a request
+    applied right away never overtakes a job of the same project created before it.
+    """
+    db.session.execute(
+        text("SELECT pg_advisory_xact_lock(:namespace, :project_id)"),
+        {'namespace': SYNC_ORDER_LOCK_NAMESPACE, 'project_id': project_id}
+    )
+
+
+def create_sync_job(project_id, user_id, data):
+    """
+    Add a sync request as a pending job, without committing.
+
+    Call sync_job_runner.submit(project_id) once the job is committed.
+
+    Returns:
+        The flushed SyncJob
+    """
+    job = SyncJob(project_id=project_id, user_id=user_id, status=SYNC_JOB_PENDING, request_data=data)
+    db.session.add(job)
+    db.session.flush()
+    return job
+
+
+def wait_for_sync_job(job_id, project_id, wait):
+    """
+    Return a project's job, waiting up to `wait` seconds for it to finish.
+
+    Returns:
+        The SyncJob, or None if it does not exist in the project
+    """
+    deadline = time.monotonic() + max(0, min(wait, SYNC_JOB_MAX_WAIT))
+    while True:
+        db.session.expire_all()
+        job = db.session.query(SyncJob).filter_by(id=job_id, project_id=project_id).first()
+        if job is None or job.is_finished or time.monotonic() >= deadline:
+            return job
+        # End the read transaction so the next poll sees the worker's commit
+        db.session.rollback()
+        time.sleep(SYNC_JOB_POLL_INTERVAL)
+
+
+class SyncJobRunner:
+    """
+    Pool of local worker processes that apply background sync jobs.
+
+    Work is handed out per project: a worker drains a project's unfinished jobs in id
+    order while holding that project's advisory lock, so jobs of one project never run
+    concurrently and never out of order, across every web worker. Each web worker
+    process has its own pool, so max_workers bounds the projects processed at once
+    per web worker, not overall.
+    """
+
+    def __init__(self, max_workers=SYNC_JOB_WORKERS):
+        self.max_workers = max_workers
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def submit(self, project_id):
+        try:
+            self._get_executor().submit(drain_project_jobs, project_id)
+        except BrokenProcessPool:
+            # A worker died and broke the pool; a new pool picks up every unfinished job
+            with self._lock:
+                self._executor = None
+            self._get_executor()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                # Spawned workers build their own app and database connections
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_init_worker
+                )
+                # Pick up jobs left behind by a previous run
+                for project_id in unfinished_job_projects():
+                    self._executor.submit(drain_project_jobs, project_id)
+            return self._executor
+
+
+sync_job_runner = SyncJobRunner()
+
+_worker_app = None
+
+
+def _init_worker():
+    global _worker_app
+    from website import create_app
+    _worker_app = create_app()
+
+
+def unfinished_job_projects():
+    """IDs of projects that have pending or interrupted jobs"""
+    return [row.project_id for row in db.session.query(SyncJob.project_id).filter(
+        SyncJob.status.in_([SYNC_JOB_PENDING, SYNC_JOB_RUNNING])
+    ).distinct()]
+
+
+def drain_project_jobs(project_id):
+    """
+    Apply a project's unfinished jobs in order; runs in a worker process.
+
+    If another worker already holds the project's lock it will pick up the new job,
+    since it checks for more work after releasing the lock.
+    """
+    with _worker_app.app_context():
+        while True:
+            connection = db.engine.connect()
+            try:
+                acquired = connection.execute(
+                    text("SELECT pg_try_advisory_lock(:namespace, :project_id)"),
+                    {'namespace': SYNC_JOB_LOCK_NAMESPACE, 'project_id': project_id}
+                ).scalar()
+                if not acquired:
+                    return
+                try:
+                    while _apply_next_job(project_id):
+                        pass
+                finally:
+                    connection.execute(
+                        text("SELECT pg_advisory_unlock(:namespace, :project_id)"),
+                        {'namespace': SYNC_JOB_LOCK_NAMESPACE, 'project_id': project_id}
+                    )
+                    connection.commit()
+            finally:
+                connection.close()
+                db.session.remove()
+
+            # A job enqueued while the lock was being released would otherwise wait
+            if not has_unfinished_job(project_id):
+                return
+
+
+def has_unfinished_job(project_id):
+    """Whether a project has pending or running jobs"""
+    return db.session.query(func.count(SyncJob.id)).filter(
+        SyncJob.project_id == project_id,
+        SyncJob.status.in_([SYNC_JOB_PENDING, SYNC_JOB_RUNNING])
+    ).scalar() > 0
+
+
+def _apply_next_job(project_id):
+    """
+    Apply the oldest unfinished job of a project, the caller holding its lock.
+
+    A job still marked running can only be one whose worker died, so it is retried.
+
+    Returns:
+        Whether a job was found
+    """
+    from website.blueprints.mobile_api import apply_sync_request
+
+    job = db.session.query(SyncJob).filter(
+        SyncJob.project_id == project_id,
+        SyncJob.status.in_([SYNC_JOB_PENDING, SYNC_JOB_RUNNING])
+    ).order_by(SyncJob.id).first()
+    if job is None:
+        db.session.rollback()
+        return False
+
+    job.status = SYNC_JOB_RUNNING
+    job.started_at = datetime.now(pytz.UTC)
+    db.session.commit()
+
+    try:
+        result = apply_sync_request(project_id, job.request_data, job.user_id)
+        # The result and the synced data are committed together
+        job.result = json.loads(current_app.json.dumps(result))
+        job.status = SYNC_JOB_COMPLETED
+    except Exception as e:
+        db.session.rollback()
+        job = db.session.get(SyncJob, job.id)
+        job.status = SYNC_JOB_FAILED
+        job.error = f"Database error: {str(e)}"
+    job.finished_at = datetime.now(pytz.UTC)
+    db.session.commit()
+    return True